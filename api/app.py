@@ -1,9 +1,16 @@
+import asyncio
+import json
+
 from config import settings
-from endpoints import file, fix, health
-from fastapi import APIRouter, Depends, FastAPI
+from endpoints import file, files, fix, health, stats
+from fastapi import APIRouter, Depends, FastAPI, status
 from fastapi.requests import Request
 from fastapi.responses import Response
 from loguru import logger
+from reshape import reshaper
+from scrubber import scrubber
+from storage import storage
+from throttle import foreground
 
 APP = FastAPI(
     version=settings.APP_VERSION,
@@ -15,13 +22,62 @@ APP = FastAPI(
 ROUTER = APIRouter()
 ROUTER.include_router(health.router, prefix="/health", tags=["health"])
 ROUTER.include_router(file.router, prefix="/file", tags=["file"])
+ROUTER.include_router(files.router, prefix="/files", tags=["files"])
 ROUTER.include_router(fix.router, prefix="/fix", tags=["fix"])
+ROUTER.include_router(stats.router, prefix="/stats", tags=["stats"])
+
+
+BACKGROUND_TASKS = []
+# routes that need the storage, answered with 503 until it is open
+STORAGE_ROUTES = tuple(
+    f"{settings.APP_PREFIX}/{prefix}" for prefix in ("file", "files", "fix", "stats")
+)
+
+
+async def migrate_and_index():
+    # the index is rebuilt from the shard directories the migration fills
+    if storage.flat:
+        await storage.migrate_layout()
+    if storage.index.get_state("indexed") is None:
+        await storage.rebuild_index()
+
+
+async def warm_up():
+    try:
+        await storage.startup()
+    except Exception as e:
+        logger.exception(f"Opening the storage failed: {e}")
+        raise
+    if storage.flat or storage.index.get_state("indexed") is None:
+        BACKGROUND_TASKS.append(asyncio.create_task(migrate_and_index()))
+    if settings.PROBE_INTERVAL > 0:
+        BACKGROUND_TASKS.append(
+            asyncio.create_task(storage.probe_forever(settings.PROBE_INTERVAL))
+        )
+    if settings.SCRUB_INTERVAL > 0:
+        BACKGROUND_TASKS.append(
+            asyncio.create_task(scrubber.run_forever(settings.SCRUB_INTERVAL))
+        )
+    if settings.RESHAPE_INTERVAL > 0:
+        BACKGROUND_TASKS.append(
+            asyncio.create_task(reshaper.run_forever(settings.RESHAPE_INTERVAL))
+        )
 
 
 # Startup event
 @APP.on_event("startup")
 async def startup_event():
     logger.info("Processing startup initialization")
+    # health probes are answered right away, the storage opens in the background
+    BACKGROUND_TASKS.append(asyncio.create_task(warm_up()))
+
+
+# Shutdown event
+@APP.on_event("shutdown")
+async def shutdown_event():
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    BACKGROUND_TASKS.clear()
 
 
 # Logs incoming request information
@@ -32,6 +88,26 @@ async def log_request(request: Request):
     logger.info(f"header: {request.headers}")
 
 
+# Refuse requests that need the storage while it is opening
+@APP.middleware("http")
+async def wait_for_storage(request: Request, call_next):
+    if not storage.ready and request.url.path.startswith(STORAGE_ROUTES):
+        detail = {"detail": "Service starting"}
+        return Response(
+            content=json.dumps(detail),
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Content-Type": "application/json"},
+        )
+    return await call_next(request)
+
+
+# Let background jobs yield to client requests
+@APP.middleware("http")
+async def track_foreground(request: Request, call_next):
+    with foreground.request():
+        return await call_next(request)
+
+
 # Log response status code and body
 @APP.middleware("http")
 async def log_response(request: Request, call_next):
@@ -0,0 +1,101 @@
+import json
+import math
+import resource
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_size(text: str) -> int:
+    """Parse a human size such as ``64K`` or ``100M`` into bytes"""
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1] if text and text[-1] in SIZE_UNITS else ""
+    return int(float(text[: len(text) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def format_size(size: int) -> str:
+    for unit in ("G", "M", "K"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile, ``pct`` in the range 0-100"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def peak_rss_mb() -> float:
+    # the peak of the whole process so far, a single case per process keeps
+    # it from carrying over the RSS of the cases run before
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
+
+
+@dataclass
+class Result:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    nbytes: int = 0
+    errors: int = 0
+
+    def record(self, elapsed: float, nbytes: int = 0) -> None:
+        self.latencies.append(elapsed)
+        self.nbytes += nbytes
+
+    def summary(self) -> Dict[str, float]:
+        elapsed = sum(self.latencies)
+        if not elapsed:
+            elapsed = float("inf")
+        return {
+            "ops": len(self.latencies),
+            "errors": self.errors,
+            "ops_per_sec": round(len(self.latencies) / elapsed, 3),
+            "mb_per_sec": round(self.nbytes / 1024**2 / elapsed, 3),
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+
+def save_baseline(path: Path, results: Dict[str, Dict[str, float]]) -> None:
+    path.write_text(json.dumps(results, indent=2, sort_keys=True))
+
+
+def load_baseline(path: Path) -> Dict[str, Dict[str, float]]:
+    return json.loads(path.read_text())
+
+
+def compare(
+    current: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float,
+) -> List[str]:
+    """Return a description of every case that regressed by more than ``threshold``
+
+    A case regresses when its throughput drops, or its p99 latency or peak
+    RSS grows, by more than the given fraction of the baseline value.
+    """
+    regressions = []
+    for name, now in sorted(current.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if now["ops_per_sec"] < before["ops_per_sec"] * (1 - threshold):
+            regressions.append(
+                f"{name}: ops_per_sec {now['ops_per_sec']} < {before['ops_per_sec']}"
+            )
+        for metric in ("p99_ms", "peak_rss_mb"):
+            if now[metric] > before[metric] * (1 + threshold):
+                regressions.append(f"{name}: {metric} {now[metric]} > {before[metric]}")
+    return regressions
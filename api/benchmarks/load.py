@@ -0,0 +1,344 @@
+"""Mixed-workload load generator
+
+Drives a running instance over HTTP with a weighted mix of POST/GET/PUT/DELETE
+requests at increasing concurrency, optionally failing a disk partway through
+and rebuilding it with ``/api/fix``. Run it from the ``api`` directory:
+
+    python -m benchmarks.load --spawn --concurrency 1,4,16 --duration 30
+    python -m benchmarks.load --url http://10.0.0.2:8000 --read-ratio 0.9 \\
+        --sizes 4K:0.7,1M:0.3 --fail-disk 1 --fail-at 20 --fix-after 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks import format_size, parse_size, percentile
+from config import settings
+from httpx import AsyncClient, HTTPError
+
+METHODS = ("post", "get", "put", "delete")
+DEFAULT_MIX = "post=2,get=6,put=1,delete=1"
+DEFAULT_SIZES = "1K:0.5,64K:0.3,1M:0.2"
+
+
+def parse_weights(text: str, sep: str) -> List[Tuple[str, float]]:
+    weights = []
+    for item in text.split(","):
+        key, _, weight = item.partition(sep)
+        weights.append((key.strip(), float(weight or 1)))
+    return weights
+
+
+def build_mix(mix: str, read_ratio: Optional[float]) -> Dict[str, float]:
+    weights = dict(parse_weights(mix, "="))
+    unknown = set(weights) - set(METHODS)
+    if unknown:
+        raise SystemExit(f"unknown methods in --mix: {', '.join(sorted(unknown))}")
+    if read_ratio is not None:
+        # keep the relative weight of the writes, rescale them around the reads
+        writes = {m: w for m, w in weights.items() if m != "get"}
+        total = sum(writes.values()) or 1
+        weights = {m: w / total * (1 - read_ratio) for m, w in writes.items()}
+        weights["get"] = read_ratio
+    return weights
+
+
+@dataclass
+class Sample:
+    at: float
+    method: str
+    latency: float
+    status: int
+    nbytes: int
+
+
+@dataclass
+class Workload:
+    client: AsyncClient
+    mix: Dict[str, float]
+    sizes: List[Tuple[int, float]]
+    names: List[str] = field(default_factory=list)
+    samples: List[Sample] = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+
+    def pick_method(self) -> str:
+        methods, weights = zip(*self.mix.items())
+        method = random.choices(methods, weights)[0]
+        # nothing to read, update or delete yet
+        if method != "post" and not self.names:
+            return "post"
+        return method
+
+    def pick_size(self) -> int:
+        sizes, weights = zip(*self.sizes)
+        return random.choices(sizes, weights)[0]
+
+    async def request(self, method: str) -> None:
+        nbytes = 0
+        if method == "post":
+            name = f"load-{uuid.uuid4().hex}"
+            nbytes = self.pick_size()
+            kwargs = {"files": {"file": (name, os.urandom(nbytes))}}
+        elif method == "put":
+            name = random.choice(self.names)
+            nbytes = self.pick_size()
+            kwargs = {"files": {"file": (name, os.urandom(nbytes))}}
+        elif method == "delete":
+            # stop other workers from picking a name that is going away
+            name = self.names.pop(random.randrange(len(self.names)))
+            kwargs = {"params": {"filename": name}}
+        else:
+            name = random.choice(self.names)
+            kwargs = {"params": {"filename": name}}
+
+        start = time.monotonic()
+        try:
+            resp = await self.client.request(method.upper(), "/api/file/", **kwargs)
+            status = resp.status_code
+            if method == "get":
+                nbytes = len(resp.content)
+        except HTTPError:
+            status = 0
+        self.samples.append(
+            Sample(
+                start - self.started, method, time.monotonic() - start, status, nbytes
+            )
+        )
+        if method == "post" and status == 201:
+            self.names.append(name)
+
+    async def worker(self, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            await self.request(self.pick_method())
+
+
+async def inject_failure(
+    client: AsyncClient, disk_path: Path, disk: int, fail_at: float, fix_after: float
+) -> List[Dict[str, float]]:
+    """Wipe a disk at ``fail_at`` seconds and rebuild it ``fix_after`` seconds later"""
+    events = []
+    started = time.monotonic()
+    await asyncio.sleep(fail_at)
+    shutil.rmtree(disk_path, ignore_errors=True)
+    disk_path.mkdir(parents=True, exist_ok=True)
+    events.append({"at": time.monotonic() - started, "event": f"disk {disk} failed"})
+
+    await asyncio.sleep(fix_after)
+    start = time.monotonic()
+    try:
+        status = (await client.post(f"/api/fix/{disk}")).status_code
+    except HTTPError:
+        status = 0
+    events.append(
+        {
+            "at": start - started,
+            "event": f"disk {disk} rebuilt",
+            "status": status,
+            "seconds": time.monotonic() - start,
+        }
+    )
+    return events
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict[str, float]:
+    latencies = [s.latency for s in samples]
+    errors = [s for s in samples if s.status == 0 or s.status >= 400]
+    return {
+        "requests": len(samples),
+        "ops_per_sec": round(len(samples) / elapsed, 3) if elapsed else 0.0,
+        "mb_per_sec": round(sum(s.nbytes for s in samples) / 1024**2 / elapsed, 3)
+        if elapsed
+        else 0.0,
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def timeline(samples: List[Sample], bucket: float) -> List[Dict[str, float]]:
+    buckets: Dict[int, List[Sample]] = {}
+    for sample in samples:
+        buckets.setdefault(int(sample.at // bucket), []).append(sample)
+    rows = []
+    for index in sorted(buckets):
+        row = summarize(buckets[index], bucket)
+        errors: Dict[str, int] = {}
+        for sample in buckets[index]:
+            if sample.status == 0 or sample.status >= 400:
+                errors[str(sample.status)] = errors.get(str(sample.status), 0) + 1
+        rows.append({"at": index * bucket, **row, "errors": errors})
+    return rows
+
+
+def saturation(levels: List[Dict[str, float]], gain: float) -> Dict[str, float]:
+    """The first level after which more concurrency stops paying off"""
+    best = levels[0]
+    for level in levels[1:]:
+        if level["ops_per_sec"] < best["ops_per_sec"] * (1 + gain):
+            break
+        best = level
+    return {"concurrency": best["concurrency"], "ops_per_sec": best["ops_per_sec"]}
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app:APP",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=Path(__file__).resolve().parents[1],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client: AsyncClient, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # /api/health answers before the storage is open
+            if (await client.get("/api/health/ready")).status_code == 200:
+                return
+        except HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+    raise SystemExit("server did not become ready")
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    mix = build_mix(args.mix, args.read_ratio)
+    sizes = [
+        (parse_size(size), weight) for size, weight in parse_weights(args.sizes, ":")
+    ]
+    report: Dict = {
+        "mix": mix,
+        "sizes": {format_size(s): w for s, w in sizes},
+        "levels": [],
+        "events": [],
+    }
+
+    async with AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        await wait_ready(client)
+        workload = Workload(client, mix, sizes)
+        await asyncio.gather(*(workload.request("post") for _ in range(args.prefill)))
+        workload.samples.clear()
+        workload.started = time.monotonic()
+
+        failure = None
+        if args.fail_disk is not None:
+            failure = asyncio.ensure_future(
+                inject_failure(
+                    client,
+                    Path(
+                        args.disk_path.format(args.fail_disk)
+                        if args.disk_path
+                        else settings.disk_path(args.fail_disk)
+                    ),
+                    args.fail_disk,
+                    args.fail_at,
+                    args.fix_after,
+                )
+            )
+
+        for concurrency in map(int, args.concurrency.split(",")):
+            first = len(workload.samples)
+            start = time.monotonic()
+            deadline = start + args.duration
+            await asyncio.gather(
+                *(workload.worker(deadline) for _ in range(concurrency))
+            )
+            level = summarize(workload.samples[first:], time.monotonic() - start)
+            report["levels"].append({"concurrency": concurrency, **level})
+            print(
+                f"concurrency={concurrency:<4} ops/s={level['ops_per_sec']:<10} "
+                f"MB/s={level['mb_per_sec']:<10} p50={level['p50_ms']}ms "
+                f"p99={level['p99_ms']}ms errors={level['error_rate']:.2%}"
+            )
+
+        if failure is not None:
+            report["events"] = await failure
+        report["timeline"] = timeline(workload.samples, args.bucket)
+        report["saturation"] = saturation(report["levels"], args.gain)
+
+        if not args.keep:
+            await asyncio.gather(
+                *(
+                    client.delete("/api/file/", params={"filename": name})
+                    for name in workload.names
+                )
+            )
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--spawn", action="store_true", help="start uvicorn app:APP locally"
+    )
+    parser.add_argument("--port", type=int, default=8765, help="port used with --spawn")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="method weights")
+    parser.add_argument("--read-ratio", type=float, help="share of GET requests")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="size:weight pairs")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument(
+        "--prefill", type=int, default=20, help="objects created upfront"
+    )
+    parser.add_argument("--timeout", type=float, default=60, help="per request seconds")
+    parser.add_argument("--bucket", type=float, default=1.0, help="timeline resolution")
+    parser.add_argument("--gain", type=float, default=0.05, help="saturation threshold")
+    parser.add_argument("--fail-disk", type=int, help="disk to wipe during the run")
+    parser.add_argument(
+        "--fail-at", type=float, default=10, help="seconds into the run"
+    )
+    parser.add_argument(
+        "--fix-after", type=float, default=5, help="seconds until /api/fix"
+    )
+    parser.add_argument(
+        "--disk-path", help="disk path template, defaults to the configured path"
+    )
+    parser.add_argument("--keep", action="store_true", help="keep the created objects")
+    parser.add_argument("--output", type=Path, help="write the full report as JSON")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        server = spawn_server(args.port)
+        args.url = f"http://127.0.0.1:{args.port}"
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    saturated = report["saturation"]
+    print(
+        f"saturation: {saturated['ops_per_sec']} ops/s at concurrency {saturated['concurrency']}"
+    )
+    for event in report["events"]:
+        print(f"{event['at']:.1f}s {event['event']} {event.get('status', '')}")
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
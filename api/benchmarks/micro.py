@@ -0,0 +1,327 @@
+"""Storage micro-benchmarks
+
+Every case runs in its own worker process, so ``NUM_DISKS`` is picked up by
+``config.Settings`` exactly like a real deployment and the peak RSS of a case
+is not inflated by the larger objects of the cases run before it. Workers
+store their disks and index in a fresh scratch directory, created under
+``--scratch`` to benchmark a particular device, since ``fix_block`` rebuilds
+every object on the disk. Run it from the ``api`` directory:
+
+    python -m benchmarks.micro --sizes 1K,1M --disks 3,5 --save baseline.json
+    python -m benchmarks.micro --sizes 1K,1M --disks 3,5 --baseline baseline.json
+
+``--data text`` uploads compressible text instead of random bytes, run it
+with ``COMPRESSION=zlib`` to measure the effect of compression.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks import (
+    Result,
+    compare,
+    format_size,
+    load_baseline,
+    parse_size,
+    save_baseline,
+)
+
+OPERATIONS = ("create", "integrity", "retrieve", "update", "fix_block", "delete")
+DEFAULT_SIZES = "1K,64K,1M,16M,100M"
+DEFAULT_DISKS = "3,5,10"
+TEXT = b"Do U Want To Meow With Me? Let's M3ow M3ow M3ow All Day!\n"
+
+
+def payload(size: int, data: str) -> bytes:
+    if data == "text":
+        return (TEXT * (size // len(TEXT) + 1))[:size]
+    return os.urandom(size)
+
+
+def drop_page_cache(block_path: List[Path]) -> None:
+    """Evict the block files from the page cache
+
+    Dropping the whole cache needs root, otherwise every block file is
+    advised out of the cache one by one.
+    """
+    os.sync()
+    try:
+        Path("/proc/sys/vm/drop_caches").write_text("3\n")
+        return
+    except OSError:
+        pass
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for root in block_path:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                fd = os.open(os.path.join(dirpath, filename), os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                finally:
+                    os.close(fd)
+
+
+class DirectTarget:
+    """Call the ``Storage`` methods directly"""
+
+    def __init__(self):
+        from storage import storage
+
+        self.storage = storage
+
+    def upload(self, name: str, data: bytes):
+        from fastapi import UploadFile
+
+        return UploadFile(
+            filename=name,
+            file=io.BytesIO(data),
+            content_type="application/octet-stream",
+        )
+
+    async def create(self, name: str, data: bytes) -> None:
+        await self.storage.create_file(self.upload(name, data))
+
+    async def integrity(self, name: str) -> None:
+        await self.storage.file_integrity(name)
+
+    async def retrieve(self, name: str) -> None:
+        await self.storage.retrieve_file(name)
+
+    async def update(self, name: str, data: bytes) -> None:
+        await self.storage.update_file(self.upload(name, data))
+
+    async def fix_block(self, block_id: int) -> None:
+        await self.storage.fix_block(block_id)
+
+    async def delete(self, name: str) -> None:
+        await self.storage.delete_file(name)
+
+    async def close(self) -> None:
+        pass
+
+
+class AsgiTarget:
+    """Drive the endpoints of the ASGI app in-process"""
+
+    # file integrity is only reachable as part of the other endpoints
+    integrity = None
+
+    def __init__(self):
+        from app import APP
+        from httpx import AsyncClient
+
+        self.app = APP
+        self.client = AsyncClient(app=APP, base_url="http://bench")
+
+    async def request(self, method: str, route: str, **kwargs) -> None:
+        resp = await self.client.request(method, self.app.url_path_for(route), **kwargs)
+        resp.raise_for_status()
+
+    async def create(self, name: str, data: bytes) -> None:
+        await self.request("POST", "file:create_file", files={"file": (name, data)})
+
+    async def retrieve(self, name: str) -> None:
+        await self.request("GET", "file:retrieve_file", params={"filename": name})
+
+    async def update(self, name: str, data: bytes) -> None:
+        await self.request("PUT", "file:update_file", files={"file": (name, data)})
+
+    async def fix_block(self, block_id: int) -> None:
+        resp = await self.client.post(
+            self.app.url_path_for("fix:fix_block", block_id=block_id)
+        )
+        resp.raise_for_status()
+
+    async def delete(self, name: str) -> None:
+        await self.request("DELETE", "file:delete_file", params={"filename": name})
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+TARGETS = {"direct": DirectTarget, "asgi": AsgiTarget}
+
+
+async def measure(result: Result, coro, nbytes: int) -> None:
+    start = time.perf_counter()
+    try:
+        await coro
+    except Exception:
+        result.errors += 1
+        return
+    result.record(time.perf_counter() - start, nbytes)
+
+
+async def run_case(
+    target,
+    size: int,
+    iterations: int,
+    cold: bool,
+    block_path: List[Path],
+    data: str = "random",
+) -> Dict[str, Result]:
+    names = [f"bench-{format_size(size)}-{k}" for k in range(iterations)]
+    results = {op: Result(op) for op in OPERATIONS}
+
+    # leftovers of an interrupted run would turn create into a conflict
+    for name in names:
+        await DirectTarget().delete(name)
+
+    for op in OPERATIONS:
+        method = getattr(target, op)
+        if method is None:
+            continue
+        if op == "fix_block":
+            if cold:
+                drop_page_cache(block_path)
+            await measure(results[op], method(0), size * iterations)
+            continue
+        for name in names:
+            if cold:
+                drop_page_cache(block_path)
+            if op in ("create", "update"):
+                coro = method(name, payload(size, data))
+            else:
+                coro = method(name)
+            await measure(results[op], coro, 0 if op == "delete" else size)
+    return results
+
+
+async def run_worker(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    from config import settings
+    from loguru import logger
+    from storage import storage
+
+    # the app logs every response body, keep it out of the terminal
+    logger.remove()
+
+    summaries = {}
+    for mode in args.modes.split(","):
+        target = TARGETS[mode]()
+        for size in map(parse_size, args.sizes.split(",")):
+            for cache in args.cache.split(","):
+                results = await run_case(
+                    target,
+                    size,
+                    args.iterations,
+                    cache == "cold",
+                    storage.block_path,
+                    args.data,
+                )
+                for op, result in results.items():
+                    if not result.latencies and not result.errors:
+                        continue
+                    key = f"{mode}:{op}:{format_size(size)}:disks={settings.NUM_DISKS}:{cache}"
+                    if args.data != "random":
+                        key += f":{args.data}"
+                    summaries[key] = result.summary()
+        await target.close()
+    return summaries
+
+
+def run_parent(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    summaries = {}
+    # ru_maxrss only grows, so every case gets a fresh process
+    cases = itertools.product(
+        args.disks.split(","),
+        args.modes.split(","),
+        args.sizes.split(","),
+        args.cache.split(","),
+    )
+    for num_disks, mode, size, cache in cases:
+        scratch = tempfile.mkdtemp(prefix="raid-bench-", dir=args.scratch)
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            command = [
+                sys.executable,
+                "-m",
+                "benchmarks.micro",
+                "--worker",
+                "--output",
+                output.name,
+                "--sizes",
+                size,
+                "--iterations",
+                str(args.iterations),
+                "--modes",
+                mode,
+                "--cache",
+                cache,
+                "--data",
+                args.data,
+            ]
+            # never touch the configured disks and index
+            env = {
+                **os.environ,
+                "NUM_DISKS": num_disks,
+                "UPLOAD_PATH": scratch,
+                "DISK_PATHS": "[]",
+                "INDEX_PATH": os.path.join(scratch, "index.db"),
+            }
+            try:
+                subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+            summaries.update(json.loads(Path(output.name).read_text()))
+    return summaries
+
+
+def print_table(summaries: Dict[str, Dict[str, float]]) -> None:
+    header = f"{'case':<48} {'ops/s':>10} {'MB/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'RSS MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, row in sorted(summaries.items()):
+        print(
+            f"{name:<48} {row['ops_per_sec']:>10} {row['mb_per_sec']:>10} "
+            f"{row['p50_ms']:>10} {row['p99_ms']:>10} {row['peak_rss_mb']:>8}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="object sizes")
+    parser.add_argument("--disks", default=DEFAULT_DISKS, help="NUM_DISKS values")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--modes", default="direct,asgi", help="direct and/or asgi")
+    parser.add_argument("--cache", default="warm,cold", help="warm and/or cold")
+    parser.add_argument(
+        "--data", default="random", choices=("random", "text"), help="payload"
+    )
+    parser.add_argument(
+        "--scratch", help="directory to create the scratch disk sets in"
+    )
+    parser.add_argument("--save", type=Path, help="write the results as a baseline")
+    parser.add_argument("--baseline", type=Path, help="baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.output.write_text(json.dumps(asyncio.run(run_worker(args))))
+        return 0
+
+    summaries = run_parent(args)
+    print_table(summaries)
+    if args.save:
+        save_baseline(args.save, summaries)
+    if args.baseline:
+        regressions = compare(summaries, load_baseline(args.baseline), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
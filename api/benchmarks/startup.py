@@ -0,0 +1,130 @@
+"""Startup time benchmark
+
+Starts the app with uvicorn several times and measures how long it takes
+until ``/api/health`` answers, which is when the worker can pass liveness
+probes, and until ``/api/health/ready`` answers, which is when the storage
+is open and the index warmed up. ``import app`` is timed on its own. Run it
+from the ``api`` directory against a scratch disk set, ``--files`` stores
+that many small files first so the index has something to load:
+
+    python -m benchmarks.startup --runs 5 --files 10000
+"""
+import argparse
+import asyncio
+import io
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks import percentile
+from benchmarks.load import spawn_server
+from httpx import Client, HTTPError
+
+API_DIR = Path(__file__).resolve().parents[1]
+IMPORT_APP = (
+    "import time; start = time.perf_counter(); import app; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_APP],
+        cwd=API_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.splitlines()[-1])
+
+
+def wait_for(client: Client, url: str, deadline: float) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            if client.get(url).status_code == 200:
+                return time.perf_counter()
+        except HTTPError:
+            pass
+        time.sleep(0.005)
+    raise SystemExit(f"{url} did not answer in time")
+
+
+def measure_start(port: int, timeout: float) -> Dict[str, float]:
+    start = time.perf_counter()
+    server = spawn_server(port)
+    try:
+        with Client(base_url=f"http://127.0.0.1:{port}") as client:
+            live = wait_for(client, "/api/health", start + timeout)
+            ready = wait_for(client, "/api/health/ready", start + timeout)
+    finally:
+        server.terminate()
+        server.wait()
+    return {"live": live - start, "ready": ready - start}
+
+
+async def prefill(count: int) -> None:
+    from fastapi import UploadFile
+    from loguru import logger
+    from storage import storage
+
+    logger.remove()
+    for i in range(count):
+        name = f"startup-{i}"
+        if storage.index.get(name) is None:
+            await storage.create_file(
+                UploadFile(filename=name, file=io.BytesIO(name.encode()))
+            )
+
+
+async def cleanup(count: int) -> None:
+    from storage import storage
+
+    for i in range(count):
+        await storage.delete_file(f"startup-{i}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--files", type=int, default=0, help="files stored upfront")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds per start")
+    parser.add_argument("--keep", action="store_true", help="keep the stored files")
+    parser.add_argument("--output", type=Path, help="write the runs as JSON")
+    args = parser.parse_args()
+
+    if args.files:
+        asyncio.run(prefill(args.files))
+
+    runs: List[Dict[str, float]] = []
+    try:
+        for run in range(args.runs):
+            result = {
+                "import": measure_import(),
+                **measure_start(args.port, args.timeout),
+            }
+            runs.append(result)
+            print(
+                f"run {run}: import={result['import'] * 1000:.1f}ms "
+                f"live={result['live'] * 1000:.1f}ms ready={result['ready'] * 1000:.1f}ms"
+            )
+    finally:
+        if args.files and not args.keep:
+            asyncio.run(cleanup(args.files))
+
+    for key in ("import", "live", "ready"):
+        samples = [run[key] for run in runs]
+        print(
+            f"{key:<8} p50={percentile(samples, 50) * 1000:.1f}ms "
+            f"max={max(samples) * 1000:.1f}ms"
+        )
+    if args.output:
+        args.output.write_text(json.dumps(runs, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
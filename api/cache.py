@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class ReadCache:
+    """LRU cache of reassembled object content bounded by a byte budget
+
+    Every entry is tagged with the generation of the object it was read
+    from, an entry whose generation no longer matches is treated as a miss.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[Hashable, bytes]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, item: Tuple[str, Hashable]) -> bool:
+        key, generation = item
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] == generation
+
+    def get(self, key: str, generation: Hashable) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != generation:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, generation: Hashable, content: bytes) -> None:
+        self.invalidate(key)
+        if len(content) > self.max_bytes:
+            return
+        self.entries[key] = (generation, content)
+        self.size += len(content)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_bytes": self.max_bytes,
+            "size": self.size,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,80 @@
+import lzma
+import math
+import zlib
+from collections import Counter
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from config import settings
+
+# content that is already compressed is stored as is
+INCOMPRESSIBLE_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/zstd",
+)
+ENTROPY_SAMPLE = 64 * 1024
+MAX_ENTROPY = 7.5  # bits per byte
+
+
+class Codec(NamedTuple):
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+CODECS: Dict[str, Codec] = {
+    "none": Codec(bytes, bytes),
+    "zlib": Codec(zlib.compress, zlib.decompress),
+    "lzma": Codec(lzma.compress, lzma.decompress),
+}
+
+
+def register(name: str, compress: Callable, decompress: Callable) -> None:
+    CODECS[name] = Codec(compress, decompress)
+
+
+def check(name: str) -> None:
+    """Fail early when the configured codec does not exist"""
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {name!r}, expected one of {sorted(CODECS)}")
+
+
+def entropy(sample: bytes) -> float:
+    """Shannon entropy of the sample in bits per byte"""
+    total = len(sample)
+    return -sum(
+        count / total * math.log2(count / total) for count in Counter(sample).values()
+    )
+
+
+def worth_compressing(content: bytes, content_type: Optional[str]) -> bool:
+    if len(content) < settings.COMPRESSION_MIN_SIZE:
+        return False
+    if content_type and content_type.startswith(INCOMPRESSIBLE_TYPES):
+        return False
+    return entropy(content[:ENTROPY_SAMPLE]) <= MAX_ENTROPY
+
+
+def encode(content: bytes, content_type: Optional[str]) -> Tuple[str, bytes]:
+    """Compress the content with the configured codec if it pays off
+
+    Returns the name of the codec that was applied and the bytes to store.
+    """
+    name = settings.COMPRESSION
+    if name == "none" or not worth_compressing(content, content_type):
+        return "none", content
+    stored = CODECS[name].compress(content)
+    if len(stored) > len(content) * (1 - settings.COMPRESSION_MIN_SAVING):
+        return "none", content
+    return name, stored
+
+
+def decode(name: str, stored: bytes) -> bytes:
+    return CODECS[name].decompress(stored)
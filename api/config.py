@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic import BaseSettings
 
 
@@ -19,7 +21,48 @@ class Settings(BaseSettings):
     UPLOAD_PATH: str = "/var/raid"
     FOLDER_PREFIX: str = "block"
     NUM_DISKS: int = 5
+    DISK_PATHS: List[str] = []  # mount path of every disk, JSON list in the env
     MAX_SIZE: int = 1024 * 1024 * 100  # 100MB
+    CAPACITY_WATERMARK: float = 0  # share of a disk writes may fill, 0 disables
+    INDEX_PATH: str = "/var/raid/index.db"
+
+    """Compression configuration"""
+    COMPRESSION: str = "none"  # none, zlib, lzma or a codec registered in codec.py
+    COMPRESSION_MIN_SIZE: int = 1024  # smaller files are stored as is
+    COMPRESSION_MIN_SAVING: float = 0.1  # share of the size compression must save
+
+    """Deduplication configuration"""
+    DEDUP: bool = False  # store identical uploads once, keyed by their SHA-256
+
+    """Read cache configuration"""
+    CACHE_MAX_BYTES: int = 1024 * 1024 * 64  # 64MB, 0 disables the cache
+
+    """Disk latency configuration"""
+    LATENCY_ALPHA: float = 0.2  # EWMA weight of the newest block read
+    HEDGE_READS: bool = True
+    HEDGE_PERCENTILE: float = 95
+    HEDGE_MIN_DELAY: float = 0.01  # seconds before a read may be hedged
+    HEDGE_SLOWDOWN: float = 2  # times slower than the other blocks to be hedged
+    PROBE_INTERVAL: float = 10  # seconds between disk probes, 0 disables
+
+    """Scrub configuration"""
+    SCRUB_INTERVAL: float = 60 * 60 * 24  # seconds between passes, 0 disables
+    SCRUB_BYTES_PER_SEC: int = 1024 * 1024 * 10  # 10MB/s
+    SCRUB_IDLE: float = 1  # seconds without client requests before scrubbing
+    SCRUB_FRESHNESS: float = 60 * 60 * 24  # seconds a clean scrub stays valid
+
+    """Reshape configuration"""
+    RESHAPE_INTERVAL: float = 60  # seconds between checks for files to restripe
+    RESHAPE_BYTES_PER_SEC: int = 1024 * 1024 * 50  # 50MB/s
+    RESHAPE_IDLE: float = 0.5  # seconds without client requests before reshaping
+
+    def disk_path(self, disk: int) -> str:
+        """Mount path of a disk, derived from UPLOAD_PATH without DISK_PATHS"""
+        if not self.DISK_PATHS:
+            return f"{self.UPLOAD_PATH}/{self.FOLDER_PREFIX}-{disk}"
+        if disk >= len(self.DISK_PATHS):
+            raise ValueError(f"DISK_PATHS has no path for disk {disk}")
+        return self.DISK_PATHS[disk]
 
 
 settings = Settings()
@@ -0,0 +1,82 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timezone
+from typing import Any
+
+import schemas
+from fastapi import APIRouter, Query, Response, status
+from storage import storage
+
+router = APIRouter()
+
+GET_FILES = {
+    400: {
+        "description": "Invalid cursor",
+        "content": {
+            "application/json": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"detail": {"type": "string"}},
+                }
+            }
+        },
+    },
+}
+
+
+def encode_cursor(name: str) -> str:
+    return base64.urlsafe_b64encode(name.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    return base64.b64decode(cursor.encode(), altchars=b"-_", validate=True).decode()
+
+
+@router.get(
+    "/",
+    status_code=status.HTTP_200_OK,
+    responses=GET_FILES,
+    response_model=schemas.FileList,
+    name="files:list_files",
+)
+@router.get(
+    "",
+    status_code=status.HTTP_200_OK,
+    responses=GET_FILES,
+    response_model=schemas.FileList,
+    name="files:list_files",
+)
+def list_files(
+    prefix: str = "",
+    cursor: str = "",
+    limit: int = Query(default=100, ge=1, le=1000),
+) -> Any:
+    try:
+        after = decode_cursor(cursor) if cursor else ""
+    except (binascii.Error, UnicodeDecodeError):
+        detail = {"detail": "Invalid cursor"}
+        response = Response(
+            content=json.dumps(detail),
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    # one extra row tells whether there is a next page
+    rows = storage.index.page(prefix, after, limit + 1)
+    files = [
+        schemas.FileInfo(
+            name=row["name"],
+            size=row["size"],
+            checksum=row["checksum"],
+            content_type=row["content_type"],
+            last_modified=datetime.fromtimestamp(row["modified"], tz=timezone.utc),
+            health=row["health"],
+            codec=row["codec"],
+            stored_size=row["stored_size"],
+        )
+        for row in rows[:limit]
+    ]
+    next_cursor = encode_cursor(files[-1].name) if len(rows) > limit else None
+    return schemas.FileList(files=files, next_cursor=next_cursor)
@@ -1,17 +1,42 @@
+import json
+
 import schemas
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Response, status
 from schemas import Msg
 from storage import storage
 
 router = APIRouter()
 
+FIX_BLOCK = {
+    404: {
+        "description": "Disk not found",
+        "content": {
+            "application/json": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"detail": {"type": "string"}},
+                }
+            }
+        },
+    },
+}
+
 
 @router.post(
     "/{block_id}",
     status_code=status.HTTP_200_OK,
+    responses=FIX_BLOCK,
     response_model=schemas.Msg,
     name="fix:fix_block",
 )
 async def fix_block(block_id: int) -> schemas.File:
+    if not 0 <= block_id < len(storage.block_path):
+        detail = {"detail": "Disk not found"}
+        response = Response(
+            content=json.dumps(detail),
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+        response.headers["Content-Type"] = "application/json"
+        return response
     await storage.fix_block(block_id)
     return Msg(detail="Block fixed")
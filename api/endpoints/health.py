@@ -1,7 +1,9 @@
-from typing import Any
+import json
+from typing import Any, List
 
 import schemas
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Response, status
+from storage import storage
 
 router = APIRouter()
 
@@ -19,6 +21,21 @@ GET_HEALTH = {
     }
 }
 
+GET_READY = {
+    200: GET_HEALTH[200],
+    503: {
+        "description": "Storage is still starting",
+        "content": {
+            "application/json": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"detail": {"type": "string"}},
+                }
+            }
+        },
+    },
+}
+
 
 @router.get(
     "/",
@@ -36,3 +53,32 @@ GET_HEALTH = {
 )
 def get_health() -> Any:
     return schemas.Msg(detail="Service healthy")
+
+
+@router.get(
+    "/disks",
+    status_code=status.HTTP_200_OK,
+    response_model=List[schemas.DiskHealth],
+    name="health:get_disks_health",
+)
+def get_disks_health() -> Any:
+    return [schemas.DiskHealth(**disk) for disk in storage.disk_health()]
+
+
+@router.get(
+    "/ready",
+    status_code=status.HTTP_200_OK,
+    responses=GET_READY,
+    response_model=schemas.Msg,
+    name="health:get_ready",
+)
+def get_ready() -> Any:
+    if not storage.ready:
+        detail = {"detail": "Service starting"}
+        response = Response(
+            content=json.dumps(detail),
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+        response.headers["Content-Type"] = "application/json"
+        return response
+    return schemas.Msg(detail="Service ready")
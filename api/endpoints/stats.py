@@ -0,0 +1,49 @@
+from typing import Any
+
+import schemas
+from fastapi import APIRouter, status
+from reshape import reshaper
+from scrubber import scrubber
+from storage import storage
+
+router = APIRouter()
+
+
+@router.get(
+    "/cache",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.CacheStats,
+    name="stats:get_cache_stats",
+)
+def get_cache_stats() -> Any:
+    return schemas.CacheStats(**storage.cache.stats())
+
+
+@router.get(
+    "/scrub",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.ScrubStats,
+    name="stats:get_scrub_stats",
+)
+def get_scrub_stats() -> Any:
+    return schemas.ScrubStats(**scrubber.stats())
+
+
+@router.get(
+    "/usage",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.UsageStats,
+    name="stats:get_usage_stats",
+)
+def get_usage_stats() -> Any:
+    return schemas.UsageStats(**storage.usage())
+
+
+@router.get(
+    "/reshape",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.ReshapeStats,
+    name="stats:get_reshape_stats",
+)
+def get_reshape_stats() -> Any:
+    return schemas.ReshapeStats(**reshaper.stats())
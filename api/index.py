@@ -0,0 +1,366 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+COLUMNS = (
+    "name",
+    "size",
+    "checksum",
+    "content_type",
+    "modified",
+    "health",
+    "scrubbed_at",
+    "codec",
+    "stored_size",
+    "content_id",
+    "num_disks",
+)
+
+USAGE_COLUMNS = (
+    "objects",
+    "logical_bytes",
+    "blocks",
+    "physical_bytes",
+    "padding_bytes",
+    "parity_bytes",
+)
+
+# columns added after the first release, created on indexes that predate them
+ADDED_COLUMNS = {
+    "objects": {
+        "codec": "TEXT NOT NULL DEFAULT 'none'",
+        "stored_size": "INTEGER",
+        "content_id": "TEXT",
+        "num_disks": "INTEGER",
+    },
+    "contents": {
+        "num_disks": "INTEGER",
+    },
+}
+
+
+def prefix_end(prefix: str) -> Optional[str]:
+    """Smallest string greater than every string starting with ``prefix``"""
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            # surrogates cannot be encoded, skip to the next valid code point
+            code = 0xE000
+        if code <= 0x10FFFF:
+            return prefix[:-1] + chr(code)
+        prefix = prefix[:-1]
+    return None
+
+
+class ObjectIndex:
+    """Metadata of every stored file kept in SQLite
+
+    Listing a page is a range scan over the primary key, so it costs the
+    same no matter how many files are stored.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS objects (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                checksum TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                modified REAL NOT NULL,
+                health TEXT NOT NULL DEFAULT 'ok',
+                scrubbed_at REAL,
+                codec TEXT NOT NULL DEFAULT 'none',
+                stored_size INTEGER,
+                content_id TEXT,
+                num_disks INTEGER
+            ) WITHOUT ROWID
+            """
+        )
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS contents (
+                id TEXT PRIMARY KEY,
+                refs INTEGER NOT NULL,
+                codec TEXT NOT NULL,
+                stored_size INTEGER NOT NULL,
+                num_disks INTEGER
+            ) WITHOUT ROWID
+            """
+        )
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {
+                row["name"] for row in self.db.execute(f"PRAGMA table_info({table})")
+            }
+            for column, definition in columns.items():
+                if column not in existing:
+                    self.db.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+                    )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS objects_content ON objects (content_id)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS usage (scope TEXT PRIMARY KEY, "
+            + ", ".join(
+                f"{column} INTEGER NOT NULL DEFAULT 0" for column in USAGE_COLUMNS
+            )
+            + ") WITHOUT ROWID"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    def put(
+        self,
+        name: str,
+        size: int,
+        checksum: str,
+        content_type: str,
+        codec: str = "none",
+        stored_size: Optional[int] = None,
+        content_id: Optional[str] = None,
+        num_disks: Optional[int] = None,
+    ) -> None:
+        """Record a file, ``stored_size`` is its length after ``codec`` was applied
+
+        Files with a ``content_id`` share the blocks of that content, the others
+        are striped over ``num_disks`` disks.
+        """
+        self.db.execute(
+            "INSERT OR REPLACE INTO objects (name, size, checksum, content_type,"
+            " modified, codec, stored_size, content_id, num_disks)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                name,
+                size,
+                checksum,
+                content_type,
+                time.time(),
+                codec,
+                stored_size,
+                content_id,
+                num_disks,
+            ),
+        )
+
+    def warm_up(self) -> None:
+        """Read the tables once, so the first requests find them in the page cache"""
+        for table in ("objects", "contents", "usage", "state"):
+            self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        row = self.db.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM objects WHERE name = ?", (name,)
+        ).fetchone()
+        return None if row is None else dict(row)
+
+    def remove(self, name: str) -> None:
+        self.db.execute("DELETE FROM objects WHERE name = ?", (name,))
+
+    def iter_objects(self) -> Iterator[Dict[str, Any]]:
+        for row in self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM objects"):
+            yield dict(row)
+
+    def iter_contents(self) -> Iterator[Dict[str, Any]]:
+        for row in self.db.execute(
+            "SELECT id, refs, codec, stored_size, num_disks FROM contents"
+        ):
+            yield dict(row)
+
+    def set_health(self, name: str, health: str, scrubbed_at: Optional[float]) -> None:
+        self.db.execute(
+            "UPDATE objects SET health = ?, scrubbed_at = ? WHERE name = ?",
+            (health, scrubbed_at, name),
+        )
+
+    def set_content_health(
+        self, content_id: str, health: str, scrubbed_at: Optional[float]
+    ) -> None:
+        self.db.execute(
+            "UPDATE objects SET health = ?, scrubbed_at = ? WHERE content_id = ?",
+            (health, scrubbed_at, content_id),
+        )
+
+    def add_content(
+        self, content_id: str, codec: str, stored_size: int, num_disks: int
+    ) -> None:
+        """Record new content referenced once"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO contents (id, refs, codec, stored_size, num_disks)"
+            " VALUES (?, 1, ?, ?, ?)",
+            (content_id, codec, stored_size, num_disks),
+        )
+
+    def get_content(self, content_id: str) -> Optional[Dict[str, Any]]:
+        row = self.db.execute(
+            "SELECT refs, codec, stored_size, num_disks FROM contents WHERE id = ?",
+            (content_id,),
+        ).fetchone()
+        return None if row is None else dict(row)
+
+    def acquire(self, content_id: str) -> Optional[Dict[str, Any]]:
+        """Take a reference to stored content, None if it is not stored"""
+        self.db.execute(
+            "UPDATE contents SET refs = refs + 1 WHERE id = ?", (content_id,)
+        )
+        row = self.db.execute(
+            "SELECT refs, codec, stored_size, num_disks FROM contents WHERE id = ?",
+            (content_id,),
+        ).fetchone()
+        return None if row is None else dict(row)
+
+    def release(self, content_id: str) -> int:
+        """Drop a reference to content and return how many are left"""
+        self.db.execute(
+            "UPDATE contents SET refs = refs - 1 WHERE id = ?", (content_id,)
+        )
+        row = self.db.execute(
+            "SELECT refs FROM contents WHERE id = ?", (content_id,)
+        ).fetchone()
+        if row is None or row[0] <= 0:
+            self.db.execute("DELETE FROM contents WHERE id = ?", (content_id,))
+            return 0
+        return row[0]
+
+    def set_num_disks(self, name: str, num_disks: int, stored_size: int) -> None:
+        self.db.execute(
+            "UPDATE objects SET num_disks = ?, stored_size = COALESCE(stored_size, ?)"
+            " WHERE name = ?",
+            (num_disks, stored_size, name),
+        )
+
+    def set_content_num_disks(self, content_id: str, num_disks: int) -> None:
+        self.db.execute(
+            "UPDATE contents SET num_disks = ? WHERE id = ?", (num_disks, content_id)
+        )
+
+    def max_num_disks(self) -> Optional[int]:
+        """Largest number of disks any file is striped over"""
+        return self.db.execute(
+            "SELECT MAX(n) FROM (SELECT MAX(num_disks) AS n FROM objects"
+            " UNION ALL SELECT MAX(num_disks) FROM contents)"
+        ).fetchone()[0]
+
+    def misplaced(
+        self,
+        content_prefix: str,
+        default: int,
+        num_disks: int,
+        after: Tuple[str, bool],
+        limit: int,
+    ) -> List[Tuple[str, bool]]:
+        """Files and contents after ``after`` striped over another number of disks
+
+        Rows are the name of a file or the ID of a content behind
+        ``content_prefix`` and whether it is a content, ordered by both since
+        a file name may equal a prefixed content ID. Files without a recorded
+        number of disks are striped over ``default`` disks.
+        """
+        rows = self.db.execute(
+            "SELECT key, content FROM ("
+            " SELECT name AS key, 0 AS content FROM objects"
+            " WHERE content_id IS NULL"
+            " AND COALESCE(num_disks, :default) != :num_disks"
+            " UNION ALL"
+            " SELECT :prefix || id, 1 FROM contents"
+            " WHERE COALESCE(num_disks, :default) != :num_disks"
+            ") WHERE (key, content) > (:after, :content)"
+            " ORDER BY key, content LIMIT :limit",
+            {
+                "prefix": content_prefix,
+                "default": default,
+                "num_disks": num_disks,
+                "after": after[0],
+                "content": after[1],
+                "limit": limit,
+            },
+        )
+        return [(row[0], bool(row[1])) for row in rows]
+
+    def forget_scrubs(self) -> None:
+        self.db.execute("UPDATE objects SET scrubbed_at = NULL")
+
+    def page(self, prefix: str, after: str, limit: int) -> List[Dict[str, Any]]:
+        """Files starting with ``prefix`` whose name sorts after ``after``"""
+        query = f"SELECT {', '.join(COLUMNS)} FROM objects WHERE name > ? AND name >= ?"
+        params: List[Any] = [after, prefix]
+        end = prefix_end(prefix)
+        if end is not None:
+            query += " AND name < ?"
+            params.append(end)
+        query += " ORDER BY name LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.db.execute(query, params)]
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        if self.db.in_transaction:
+            # part of the transaction of the caller
+            yield
+            return
+        self.db.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def add_usage(self, deltas: Dict[str, Dict[str, int]]) -> None:
+        """Add to the usage counters of every scope in one transaction"""
+        with self.transaction():
+            for scope, delta in deltas.items():
+                columns = [column for column in USAGE_COLUMNS if delta.get(column)]
+                if not columns:
+                    continue
+                self.db.execute(
+                    f"INSERT INTO usage (scope, {', '.join(columns)})"
+                    f" VALUES (?{', ?' * len(columns)}) ON CONFLICT (scope) DO UPDATE SET "
+                    + ", ".join(
+                        f"{column} = {column} + excluded.{column}" for column in columns
+                    ),
+                    [scope] + [delta[column] for column in columns],
+                )
+
+    def set_usage(self, counters: Dict[str, Dict[str, int]]) -> None:
+        """Replace the usage counters of the given scopes"""
+        for scope, values in counters.items():
+            self.db.execute(
+                f"INSERT OR REPLACE INTO usage (scope, {', '.join(USAGE_COLUMNS)})"
+                f" VALUES (?{', ?' * len(USAGE_COLUMNS)})",
+                [scope] + [values.get(column, 0) for column in USAGE_COLUMNS],
+            )
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        return {
+            row["scope"]: {column: row[column] for column in USAGE_COLUMNS}
+            for row in self.db.execute("SELECT * FROM usage")
+        }
+
+    def get_state(self, key: str) -> Optional[str]:
+        row = self.db.execute(
+            "SELECT value FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set_state(self, key: str, value: Optional[str]) -> None:
+        if value is None:
+            self.db.execute("DELETE FROM state WHERE key = ?", (key,))
+        else:
+            self.db.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def clear(self) -> None:
+        self.db.execute("DELETE FROM objects")
+        self.db.execute("DELETE FROM contents")
+        self.db.execute("DELETE FROM usage")
+        self.db.execute("DELETE FROM state")
@@ -0,0 +1,87 @@
+import math
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+PROBE_FILE = ".probe"
+PROBE_DATA = b"\x00" * 4096
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def probe(path: Path) -> float:
+    """Write, sync and read back a small file on the disk, return the seconds it took"""
+    probe_file = path / PROBE_FILE
+    start = time.monotonic()
+    fd = os.open(probe_file, os.O_CREAT | os.O_WRONLY | os.O_TRUNC)
+    try:
+        os.write(fd, PROBE_DATA)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    probe_file.read_bytes()
+    probe_file.unlink()
+    return time.monotonic() - start
+
+
+class DiskLatency:
+    """Block read latency of every disk
+
+    Keeps an EWMA per disk and a window of recent samples pooled over all
+    disks, a disk whose EWMA is above the pooled percentile is slow.
+    """
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, alpha: float, window: int = 512):
+        self.alpha = alpha
+        self.ewma: Dict[int, float] = {}
+        self.recent: Deque[float] = deque(maxlen=window)
+        self.probes: Dict[int, Dict[str, Optional[float]]] = {}
+        self.hedged: Dict[int, int] = {}
+
+    def record(self, disk: int, seconds: float) -> None:
+        self.recent.append(seconds)
+        if disk not in self.ewma:
+            self.ewma[disk] = seconds
+        else:
+            self.ewma[disk] += self.alpha * (seconds - self.ewma[disk])
+
+    def record_probe(self, disk: int, seconds: Optional[float]) -> None:
+        self.probes[disk] = {"at": time.time(), "seconds": seconds}
+
+    def record_hedge(self, disk: int) -> None:
+        self.hedged[disk] = self.hedged.get(disk, 0) + 1
+
+    def threshold(self, pct: float) -> Optional[float]:
+        if len(self.recent) < self.MIN_SAMPLES:
+            return None
+        return percentile(list(self.recent), pct)
+
+    def stats(self, num_disks: int, pct: float) -> List[Dict[str, Any]]:
+        threshold = self.threshold(pct)
+        stats = []
+        for disk in range(num_disks):
+            ewma = self.ewma.get(disk)
+            probe = self.probes.get(disk, {})
+            stats.append(
+                {
+                    "disk": disk,
+                    "ewma_ms": None if ewma is None else ewma * 1000,
+                    "probe_ms": None
+                    if probe.get("seconds") is None
+                    else probe["seconds"] * 1000,
+                    "probed_at": probe.get("at"),
+                    "hedged": self.hedged.get(disk, 0),
+                    "slow": threshold is not None
+                    and ewma is not None
+                    and ewma > threshold,
+                }
+            )
+        return stats
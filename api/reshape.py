@@ -0,0 +1,80 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from config import settings
+from loguru import logger
+from storage import Storage, storage
+from throttle import TokenBucket, foreground
+
+# state key of the last block key a pass handled
+RESHAPE_CURSOR = "reshape_cursor"
+PAGE_SIZE = 100
+
+
+class Reshaper:
+    """Restripe the files stored over another number of disks onto NUM_DISKS
+
+    Like the scrubber it only runs while clients are idle and reads at most
+    RESHAPE_BYTES_PER_SEC. The last file handled is kept in the index, so a
+    restart resumes the pass where it stopped.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.bucket = TokenBucket(settings.RESHAPE_BYTES_PER_SEC)
+        self.states: Dict[str, int] = {}
+        self.bytes = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    async def reshape_all(self) -> None:
+        index = self.storage.index
+        after = index.get_state(RESHAPE_CURSOR) or ""
+        keys = self.storage.misplaced(after, PAGE_SIZE)
+        if not keys:
+            index.set_state(RESHAPE_CURSOR, None)
+            return
+
+        self.started_at = time.time()
+        logger.info(f"Reshape onto {settings.NUM_DISKS} disks started")
+        while keys:
+            for key in keys:
+                await foreground.wait_idle(settings.RESHAPE_IDLE)
+                try:
+                    state, nbytes = await self.storage.reshape_file(
+                        key, settings.NUM_DISKS
+                    )
+                except Exception as e:
+                    # one bad file must not hold the cursor back for every pass
+                    logger.exception(f"Reshape of {key} failed: {e}")
+                    state, nbytes = "failed", 0
+                self.states[state] = self.states.get(state, 0) + 1
+                self.bytes += nbytes
+                index.set_state(RESHAPE_CURSOR, key)
+                await self.bucket.consume(nbytes)
+            keys = self.storage.misplaced(keys[-1], PAGE_SIZE)
+        # busy, damaged and failed files are retried by the next pass
+        index.set_state(RESHAPE_CURSOR, None)
+        self.finished_at = time.time()
+        logger.info(f"Reshape finished: {self.states}")
+
+    async def run_forever(self, interval: float) -> None:
+        while True:
+            try:
+                await self.reshape_all()
+            except Exception as e:
+                logger.exception(f"Reshape failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            "num_disks": settings.NUM_DISKS,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "bytes": self.bytes,
+            "states": self.states,
+        }
+
+
+reshaper: Reshaper = Reshaper(storage)
@@ -1,4 +1,17 @@
-from .file import File
+from .disk import DiskHealth
+from .file import File, FileInfo, FileList
 from .msg import Msg
+from .stats import CacheStats, DiskUsage, ReshapeStats, ScrubStats, UsageStats
 
-__all__ = ["Msg", "File"]
+__all__ = [
+    "Msg",
+    "File",
+    "FileInfo",
+    "FileList",
+    "CacheStats",
+    "DiskHealth",
+    "ScrubStats",
+    "ReshapeStats",
+    "DiskUsage",
+    "UsageStats",
+]
@@ -0,0 +1,19 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+# Disk health schema
+class DiskHealth(BaseModel):
+    disk: int
+    path: str
+    exists: bool
+    writable: bool
+    total_bytes: Optional[int]
+    used_bytes: Optional[int]
+    free_bytes: Optional[int]
+    ewma_ms: Optional[float]
+    probe_ms: Optional[float]
+    probed_at: Optional[float]
+    hedged: int
+    slow: bool
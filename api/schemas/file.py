@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import List, Optional
+
 from pydantic import BaseModel
 
 
@@ -8,3 +11,21 @@ class File(BaseModel):
     checksum: str
     content: bytes
     content_type: str
+
+
+# File metadata schema
+class FileInfo(BaseModel):
+    name: str
+    size: int
+    checksum: str
+    content_type: str
+    last_modified: datetime
+    health: str
+    codec: str
+    stored_size: Optional[int]
+
+
+# File listing schema
+class FileList(BaseModel):
+    files: List[FileInfo]
+    next_cursor: Optional[str]
@@ -0,0 +1,49 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+# Read cache statistics
+class CacheStats(BaseModel):
+    max_bytes: int
+    size: int
+    entries: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+# Scrub statistics
+class ScrubStats(BaseModel):
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    bytes: int
+    states: Dict[str, int]
+
+
+# Usage of a disk
+class DiskUsage(BaseModel):
+    disk: int
+    blocks: int
+    physical_bytes: int
+    padding_bytes: int
+    parity_bytes: int
+
+
+# Usage statistics
+class UsageStats(BaseModel):
+    objects: int
+    logical_bytes: int
+    physical_bytes: int
+    padding_bytes: int
+    parity_bytes: int
+    disks: List[DiskUsage]
+
+
+# Reshape statistics
+class ReshapeStats(BaseModel):
+    num_disks: int
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    bytes: int
+    states: Dict[str, int]
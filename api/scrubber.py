@@ -0,0 +1,55 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from config import settings
+from loguru import logger
+from storage import Storage, storage
+from throttle import TokenBucket, foreground
+
+
+class Scrubber:
+    """Verify every file in the background and repair single block damage
+
+    The scrubber only runs while no client request has been served for
+    SCRUB_IDLE seconds and reads at most SCRUB_BYTES_PER_SEC.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.bucket = TokenBucket(settings.SCRUB_BYTES_PER_SEC)
+        self.states: Dict[str, int] = {}
+        self.bytes = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    async def scrub_all(self) -> None:
+        self.started_at = time.time()
+        logger.info("Scrub started")
+        for filename in self.storage.iter_files():
+            await foreground.wait_idle(settings.SCRUB_IDLE)
+            state, nbytes = await self.storage.scrub_file(filename)
+            self.states[state] = self.states.get(state, 0) + 1
+            self.bytes += nbytes
+            await self.bucket.consume(nbytes)
+        self.finished_at = time.time()
+        logger.info(f"Scrub finished: {self.states}")
+
+    async def run_forever(self, interval: float) -> None:
+        while True:
+            try:
+                await self.scrub_all()
+            except Exception as e:
+                logger.exception(f"Scrub failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "bytes": self.bytes,
+            "states": self.states,
+        }
+
+
+scrubber: Scrubber = Scrubber(storage)
@@ -1,50 +1,784 @@
 import asyncio
 import base64
 import hashlib
+import itertools
 import json
 import os
+import shutil
 import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import quote, unquote
 
+import aiofiles
+import codec
 import schemas
+from cache import ReadCache
 from config import settings
 from fastapi import Response, UploadFile, status
+from index import ObjectIndex
+from latency import PROBE_FILE, DiskLatency, probe
 from loguru import logger
+from usage import TOTAL, Usage, disk_scope, summarize
 
 
 def byte_xor(ba1, ba2):
-    return bytes([_a ^ _b for _a, _b in zip(ba1, ba2)])
+    # XOR the blocks as big integers, a byte by byte loop is far too slow
+    # to rebuild a block faster than a slow disk can read it
+    size = min(len(ba1), len(ba2))
+    return (
+        int.from_bytes(ba1[:size], "big") ^ int.from_bytes(ba2[:size], "big")
+    ).to_bytes(size, "big")
 
 
-async def write_part_file(part_file, part):
+def write_block(part_file, part):
+    part_file.parent.mkdir(parents=True, exist_ok=True)
     with open(part_file, "wb") as f:
         f.write(part)
         f.close()
 
 
+async def write_part_file(part_file, part):
+    # write on a worker thread, so the blocks of different disks are written
+    # in parallel instead of one after the other on the event loop
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, write_block, part_file, part)
+
+
+def on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def disk_usage(path: Path) -> dict:
+    """Capacity and state of the filesystem a disk is mounted on"""
+    usage = {
+        "path": str(path),
+        "exists": path.is_dir(),
+        "writable": os.access(path, os.W_OK),
+        "total_bytes": None,
+        "used_bytes": None,
+        "free_bytes": None,
+    }
+    try:
+        total, used, free = shutil.disk_usage(path)
+    except OSError:
+        return usage
+    usage.update(total_bytes=total, used_bytes=used, free_bytes=free)
+    return usage
+
+
+def split_parts(content: bytes, num_parts: int) -> List[bytes]:
+    """Split the content into data blocks of equal size
+
+    The first ``len(content) % num_parts`` blocks hold one byte more than the
+    others, which are padded with a single zero byte instead.
+    """
+    length = len(content)
+    chunk_size = length // num_parts
+    parts = []
+    now = 0
+
+    for i in range(length % num_parts):
+        part = content[now : now + chunk_size + 1]
+        parts.append(part)
+
+        now += chunk_size + 1
+
+    for i in range(length % num_parts, num_parts):
+        part = content[now : now + chunk_size] + b"\x00"
+        parts.append(part)
+
+        now += chunk_size
+
+    return parts
+
+
+def join_parts(blocks: List[bytes], length: Optional[int]) -> bytes:
+    """Reassemble the content of ``length`` bytes split by ``split_parts``
+
+    Without a known length the padding is stripped, along with any zero bytes
+    the content really ended with.
+    """
+    if length is None:
+        return b"".join(block.rstrip(b"\x00") for block in blocks)
+    chunk_size = length // len(blocks)
+    extra = length % len(blocks)
+    return b"".join(
+        block[: chunk_size + 1 if i < extra else chunk_size]
+        for i, block in enumerate(blocks)
+    )
+
+
+# temporary name of a block while it moves from the flat layout into its shard
+MIGRATING_PREFIX = ".migrating-"
+# deduplicated content is stored under its SHA-256 behind this prefix
+CONTENT_PREFIX = "@"
+# temporary name of a block while its file is restriped over another disk count
+RESHAPING_PREFIX = ".reshaping-"
+# state keys of the index
+LEGACY_DISKS = "legacy_num_disks"
+RESHAPE_JOURNAL = "reshape_journal"
+USAGE_COUNTED = "usage_counted"
+
+
+def escape_name(filename: str) -> str:
+    """Name of the block file of ``filename``, which may contain slashes"""
+    return filename.replace("%", "%25").replace("/", "%2F")
+
+
+def unescape_name(name: str) -> str:
+    return unquote(name)
+
+
+def reshaping_file(path: Path) -> Path:
+    """Temporary path of a block while its file is restriped"""
+    return path.parent / (RESHAPING_PREFIX + path.name)
+
+
+def file_key(filename: str) -> str:
+    """Block key of a file stored under its own name
+
+    Names starting with the content prefix are escaped, along with names
+    starting with an escape, so no file shares its key with deduplicated
+    content.
+    """
+    if filename.startswith((CONTENT_PREFIX, "%")):
+        return quote(filename, safe="")
+    return filename
+
+
+def key_filename(key: str) -> Optional[str]:
+    """Name of the file stored under a block key, None for deduplicated content"""
+    if key.startswith(CONTENT_PREFIX):
+        return None
+    if key.startswith("%"):
+        return unquote(key)
+    return key
+
+
+def block_key(filename: str, meta: Optional[Dict]) -> str:
+    """Name the blocks of a file are stored under"""
+    if meta is None or meta["content_id"] is None:
+        return file_key(filename)
+    return CONTENT_PREFIX + meta["content_id"]
+
+
+# opened on first access, see Storage.open
+LAZY_ATTRIBUTES = ("index", "legacy_disks", "block_path", "flat")
+
+
 class Storage:
     def __init__(self, is_test: bool):
+        self.is_test = is_test
+        self.cache = ReadCache(settings.CACHE_MAX_BYTES)
+        # generations of the keys touched while they were read, see reading
+        self.generations: Dict[str, int] = {}
+        self.readers: Counter = Counter()
+        self.epoch = 0
+        self.__generation = itertools.count(1)
+        self.latency = DiskLatency(settings.LATENCY_ALPHA)
+        self.writing: Set[str] = set()
+        self.ready = False
+        self.__opened = False
+        self.__opening = False
+        self.__lock = threading.RLock()
+
+    def __getattr__(self, name: str):
+        # only called for attributes that are not set yet
+        if name in LAZY_ATTRIBUTES:
+            self.open()
+            return object.__getattribute__(self, name)
+        raise AttributeError(name)
+
+    def open(self) -> None:
+        """Open the index and the disks
+
+        Nothing is touched on import, the app opens the storage on startup
+        and anything using it earlier opens it on first access.
+        """
+        # the event loop must never wait for the worker thread opening it
+        if not self.__lock.acquire(blocking=not on_event_loop()):
+            raise RuntimeError("Storage is still opening")
+        try:
+            if self.__opened or self.__opening:
+                return
+            self.__opening = True
+            try:
+                self.__open()
+                self.__opened = True
+            finally:
+                self.__opening = False
+        finally:
+            self.__lock.release()
+
+    def __open(self) -> None:
+        codec.check(settings.COMPRESSION)
+        is_test = self.is_test
+        self.index = ObjectIndex(
+            Path("/var/raid") / "index-test.db"
+            if is_test
+            else Path(settings.INDEX_PATH)
+        )
+        # files indexed without a number of disks were written before it was
+        # recorded, with the NUM_DISKS of the first start that recorded it
+        legacy_disks = self.index.get_state(LEGACY_DISKS)
+        if legacy_disks is None:
+            self.index.set_state(LEGACY_DISKS, str(settings.NUM_DISKS))
+        self.legacy_disks = int(legacy_disks or settings.NUM_DISKS)
+        # disks dropped from NUM_DISKS stay readable until every file left them
+        num_disks = max(
+            settings.NUM_DISKS, self.legacy_disks, self.index.max_num_disks() or 0
+        )
         self.block_path: List[Path] = [
             Path("/var/raid") / f"{settings.FOLDER_PREFIX}-{i}-test"
             if is_test
-            else Path(settings.UPLOAD_PATH) / f"{settings.FOLDER_PREFIX}-{i}"
-            for i in range(settings.NUM_DISKS)
+            else Path(settings.disk_path(i))
+            for i in range(num_disks)
         ]
+        self.flat: Set[int] = set()
         self.__create_block()
+        self.recover_reshape()
+        if self.index.get_state(USAGE_COUNTED) is None:
+            self.recount_usage()
+
+    async def startup(self) -> None:
+        """Open the storage off the event loop and warm up the index
+
+        Requests are answered meanwhile, the storage is ready once done.
+        """
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.open)
+        await loop.run_in_executor(None, self.index.warm_up)
+        self.ready = True
+        logger.info(f"Storage ready in {time.monotonic() - start:.3f}s")
 
     def __create_block(self):
-        for path in self.block_path:
-            logger.warning(f"Creating folder: {path}")
+        for i, path in enumerate(self.block_path):
+            logger.debug(f"Creating folder: {path}")
             path.mkdir(parents=True, exist_ok=True)
+            with os.scandir(path) as entries:
+                if any(self.__is_flat(entry) for entry in entries):
+                    logger.warning(f"Folder {path} uses the flat layout")
+                    self.flat.add(i)
+
+    @staticmethod
+    def __is_flat(entry: os.DirEntry) -> bool:
+        return entry.is_file(follow_symlinks=False) and not entry.name.startswith(
+            PROBE_FILE
+        )
+
+    def __shard(self, disk: int, key: str) -> Path:
+        # the directories follow the filename, as they did before keys existed
+        digest = hashlib.md5((key_filename(key) or key).encode()).hexdigest()
+        return self.block_path[disk] / digest[:2] / digest[2:4] / escape_name(key)
+
+    def block_file(self, disk: int, key: str) -> Path:
+        """Path of the block stored under a block key on a disk
+
+        Blocks live in two levels of directories named after the hash of the
+        filename. Blocks of the flat layout are moved there when accessed, as
+        are blocks stored under the name of the file instead of its key.
+        """
+        path = self.__shard(disk, key)
+        if disk in self.flat and not path.exists():
+            self.__migrate(disk, key)
+        elif path.name != key and not path.exists():
+            self.__rename_legacy(key, path)
+        return path
+
+    def __rename_legacy(self, key: str, path: Path) -> None:
+        filename = key_filename(key) or key
+        if filename.startswith(CONTENT_PREFIX) and self.index.get_content(
+            filename[len(CONTENT_PREFIX) :]
+        ):
+            # the block under that name belongs to deduplicated content
+            return
+        for name in (escape_name(filename), filename):
+            legacy = path.parent / name
+            if name != path.name and legacy.is_file():
+                os.replace(legacy, path)
+                return
+
+    def __migrate(self, disk: int, key: str) -> None:
+        # flat blocks are named after their file
+        filename = key_filename(key) or key
+        flat = self.block_path[disk] / filename
+        moving = self.block_path[disk] / f"{MIGRATING_PREFIX}{filename}"
+        if flat.is_file():
+            os.replace(flat, moving)
+        if not moving.is_file():
+            return
+
+        path = self.__shard(disk, key)
+        if path.parent.parent.is_file():
+            # a flat block has the name of the shard directory
+            self.__migrate(disk, file_key(path.parent.parent.name))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(moving, path)
+
+    async def migrate_layout(self) -> None:
+        """Move every block of the flat layout into its shard directory"""
+        for disk in sorted(self.flat):
+            root = self.block_path[disk]
+            migrated = 0
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.name.startswith(MIGRATING_PREFIX):
+                        name = entry.name[len(MIGRATING_PREFIX) :]
+                        self.__migrate(disk, file_key(name))
+                    elif self.__is_flat(entry):
+                        self.__migrate(disk, file_key(entry.name))
+                    else:
+                        continue
+                    migrated += 1
+                    if migrated % 1000 == 0:
+                        await asyncio.sleep(0)
+            self.flat.discard(disk)
+            logger.info(f"Moved {migrated} blocks of {root} into shard directories")
+
+    def __walk(self, disk: int) -> Iterator[str]:
+        """Stream the block key of every block stored on a disk"""
+        root = self.block_path[disk]
+        if not root.is_dir():
+            return
+        with os.scandir(root) as shards:
+            for shard in shards:
+                if self.__is_flat(shard) and not shard.name.startswith(
+                    MIGRATING_PREFIX
+                ):
+                    # flat blocks predate deduplication and are named after their file
+                    yield file_key(shard.name)
+                if not shard.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(shard.path) as subshards:
+                    for subshard in subshards:
+                        if not subshard.is_dir(follow_symlinks=False):
+                            continue
+                        with os.scandir(subshard.path) as entries:
+                            for entry in entries:
+                                if entry.is_file(
+                                    follow_symlinks=False
+                                ) and not entry.name.startswith(RESHAPING_PREFIX):
+                                    yield self.__stored_key(unescape_name(entry.name))
+
+    def __stored_key(self, key: str) -> str:
+        # files named like content used to be stored under their plain name
+        if (
+            key_filename(key) is None
+            and self.index.get_content(key[len(CONTENT_PREFIX) :]) is None
+            and self.index.get(key) is not None
+        ):
+            return file_key(key)
+        return key
+
+    def __touch(self, filename: str) -> None:
+        # a new generation turns every in-flight read into a miss, without
+        # one in flight dropping the cached content is enough
+        if filename in self.readers:
+            self.generations[filename] = next(self.__generation)
+        else:
+            self.generations.pop(filename, None)
+        self.cache.invalidate(filename)
+
+    @contextmanager
+    def reading(self, *keys: str) -> Iterator[None]:
+        """Track reads of the keys, so writes meanwhile change their generation
+
+        The generation is forgotten once the last reader is done, which keeps
+        the map as small as the number of reads in flight.
+        """
+        self.readers.update(keys)
+        try:
+            yield
+        finally:
+            self.readers.subtract(keys)
+            for key in keys:
+                if self.readers[key] <= 0:
+                    del self.readers[key]
+                    self.generations.pop(key, None)
+
+    def key_meta(self, key: str) -> Optional[Dict]:
+        """Index row of the file or deduplicated content stored under ``key``"""
+        filename = key_filename(key)
+        if filename is None:
+            return self.index.get_content(key[len(CONTENT_PREFIX) :])
+        return self.index.get(filename)
+
+    def disks_of(self, key: str) -> int:
+        """Number of disks the blocks stored under ``key`` are striped over"""
+        meta = self.key_meta(key)
+        if meta is None or meta["num_disks"] is None:
+            return self.legacy_disks
+        return meta["num_disks"]
+
+    def footprint(self, meta: Dict) -> Tuple[int, int]:
+        """Stored size and number of disks of an indexed file or content"""
+        stored_size = meta["stored_size"]
+        if stored_size is None:
+            stored_size = meta["size"]
+        return stored_size, meta["num_disks"] or self.legacy_disks
+
+    def recount_usage(self) -> None:
+        """Derive the usage counters from the index, once after upgrading"""
+        usage = Usage()
+        for meta in self.index.iter_objects():
+            usage.add_file(meta["size"])
+            if meta["content_id"] is None:
+                usage.add_blocks(*self.footprint(meta))
+        for content in self.index.iter_contents():
+            usage.add_blocks(*self.footprint(content))
+        scopes = [TOTAL] + [disk_scope(i) for i in range(len(self.block_path))]
+        with self.index.transaction():
+            self.index.set_usage({scope: usage.deltas[scope] for scope in scopes})
+            self.index.set_state(USAGE_COUNTED, "1")
+
+    def usage(self) -> dict:
+        return summarize(self.index.usage(), len(self.block_path))
+
+    def over_watermark(self, length: int) -> bool:
+        """Whether a file of ``length`` bytes fills a disk past CAPACITY_WATERMARK"""
+        if not settings.CAPACITY_WATERMARK:
+            return False
+        block_size = length // (settings.NUM_DISKS - 1) + 1
+        for path in self.block_path[: settings.NUM_DISKS]:
+            total, used, _ = shutil.disk_usage(path)
+            if used + block_size > total * settings.CAPACITY_WATERMARK:
+                return True
+        return False
+
+    def generation(self, filename: str) -> Tuple[int, int]:
+        return self.epoch, self.generations.get(filename, 0)
+
+    def is_cached(self, filename: str) -> bool:
+        return (filename, self.generation(filename)) in self.cache
+
+    def recently_scrubbed(self, filename: str) -> bool:
+        meta = self.index.get(filename)
+        return (
+            meta is not None
+            and meta["scrubbed_at"] is not None
+            and time.time() - meta["scrubbed_at"] < settings.SCRUB_FRESHNESS
+        )
+
+    async def rebuild_index(self) -> None:
+        """Index the files stored before the index existed"""
+        indexed = 0
+        for key in self.iter_files():
+            filename = key_filename(key)
+            if filename is None:
+                # only reachable through the names already in the index
+                continue
+            if self.index.get(filename) is not None:
+                continue
+            content = await self.retrieve_file(filename)
+            if content is None or self.index.get(filename) is not None:
+                continue
+            usage = Usage()
+            usage.add_file(len(content))
+            usage.add_blocks(len(content), self.legacy_disks)
+            with self.index.transaction():
+                self.index.put(
+                    filename,
+                    len(content),
+                    hashlib.md5(content).hexdigest(),
+                    "application/octet-stream",
+                    stored_size=len(content),
+                    num_disks=self.legacy_disks,
+                )
+                self.index.add_usage(usage.deltas)
+            indexed += 1
+        self.index.set_state("indexed", "1")
+        logger.info(f"Indexed {indexed} files")
+
+    def iter_files(self) -> Iterator[str]:
+        """Stream the block key of every file exactly once
+
+        Any file with at most one lost block still has a block on disk 0 or 1.
+        Deduplicated content is streamed once, not once for every name.
+        """
+        yield from self.__walk(0)
+        for filename in self.__walk(1):
+            if not self.block_file(0, filename).exists():
+                yield filename
+
+    async def probe_disks(self) -> None:
+        loop = asyncio.get_running_loop()
+        for i in range(len(self.block_path)):
+            try:
+                seconds = await loop.run_in_executor(None, probe, self.block_path[i])
+            except OSError as e:
+                logger.error(f"Probe of disk {i} failed: {e}")
+                seconds = None
+            self.latency.record_probe(i, seconds)
+
+    async def probe_forever(self, interval: float) -> None:
+        while True:
+            await self.probe_disks()
+            await asyncio.sleep(interval)
+
+    def disk_health(self) -> List[dict]:
+        stats = self.latency.stats(len(self.block_path), settings.HEDGE_PERCENTILE)
+        for disk, path in zip(stats, self.block_path):
+            disk.update(disk_usage(path))
+        return stats
+
+    async def __read_block(self, disk: int, filename: str) -> bytes:
+        start = time.monotonic()
+        async with aiofiles.open(self.block_file(disk, filename), "rb") as f:
+            block = await f.read()
+        self.latency.record(disk, time.monotonic() - start)
+        return block
+
+    async def __read_blocks(
+        self, filename: str, num_disks: int, hedge: bool = True
+    ) -> Optional[Tuple[List[bytes], bool]]:
+        """Read the data blocks of a file in one pass, verified against parity
+
+        All blocks including parity are read concurrently. Once N-1 blocks
+        arrived, the last one is waited for HEDGE_SLOWDOWN times as long as
+        they took, so the delay scales with the block size. A straggler
+        slower than that is dropped, a missing data block is rebuilt from
+        parity and the straggler is left to finish in the background.
+        Returns None if the file is damaged, else the data blocks and whether
+        they were verified against parity, which is not possible once a block
+        is missing.
+        """
+        start = time.monotonic()
+        tasks = [
+            asyncio.ensure_future(self.__read_block(i, filename))
+            for i in range(num_disks)
+        ]
+
+        pending = set(tasks)
+        while len(pending) > 1:
+            _, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+        if pending and any(task.exception() for task in tasks if task.done()):
+            # a lost block can only be rebuilt if every other block arrives
+            await asyncio.wait(pending)
+            pending = set()
+        elif pending:
+            delay = None
+            if hedge and settings.HEDGE_READS:
+                elapsed = time.monotonic() - start
+                delay = max(
+                    settings.HEDGE_MIN_DELAY, elapsed * (settings.HEDGE_SLOWDOWN - 1)
+                )
+            _, pending = await asyncio.wait(pending, timeout=delay)
+        failed = [i for i, task in enumerate(tasks) if task.done() and task.exception()]
+        for task in pending:
+            # the straggler is not awaited anymore, still record its latency
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        hedged = [i for i, task in enumerate(tasks) if task in pending]
+        for i in hedged:
+            self.latency.record_hedge(i)
+
+        missing = hedged + failed
+        if len(missing) > 1:
+            return None
+        blocks = [
+            None if i in missing else task.result() for i, task in enumerate(tasks)
+        ]
+        size = next(len(block) for block in blocks if block is not None)
+        if any(len(block) != size for block in blocks if block is not None):
+            return None
+
+        if not missing:
+            xor_result = blocks[0]
+            for block in blocks[1:-1]:
+                xor_result = byte_xor(xor_result, block)
+            if xor_result != blocks[-1]:
+                return None
+            return blocks[:-1], True
+
+        if missing[0] != num_disks - 1:
+            logger.info(f"Rebuilding block {missing[0]} of {filename} from parity")
+            xor_result = blocks[-1]
+            for block in blocks[:-1]:
+                if block is not None:
+                    xor_result = byte_xor(xor_result, block)
+            blocks[missing[0]] = xor_result
+        return blocks[:-1], False
+
+    async def __load_block(self, disk: int, filename: str) -> Optional[bytes]:
+        try:
+            async with aiofiles.open(self.block_file(disk, filename), "rb") as f:
+                return await f.read()
+        except FileNotFoundError:
+            return None
+
+    async def scrub_file(self, filename: str) -> Tuple[str, int]:
+        """Verify a file against parity and rebuild a single lost or truncated block
+
+        Returns the state of the file, one of ok, repaired, damaged, missing or
+        busy when it is being written, and the number of bytes read.
+        """
+        if filename in self.writing:
+            return "busy", 0
+        with self.reading(filename):
+            return await self.__scrub_file(filename)
+
+    async def __scrub_file(self, filename: str) -> Tuple[str, int]:
+        generation = self.generation(filename)
+        num_disks = self.disks_of(filename)
+        blocks = await asyncio.gather(
+            *(self.__load_block(i, filename) for i in range(num_disks))
+        )
+        if all(block is None for block in blocks):
+            return "missing", 0
+        nbytes = sum(len(block) for block in blocks if block is not None)
+        if filename in self.writing or self.generation(filename) != generation:
+            return "busy", nbytes
+
+        # the block whose size differs from the others is the broken one
+        sizes = Counter(len(block) for block in blocks if block is not None)
+        size = sizes.most_common(1)[0][0]
+        broken = [
+            i for i, block in enumerate(blocks) if block is None or len(block) != size
+        ]
+
+        if not broken:
+            xor_result = blocks[0]
+            for block in blocks[1:-1]:
+                xor_result = byte_xor(xor_result, block)
+            state = "ok" if xor_result == blocks[-1] else "damaged"
+        elif len(broken) == 1:
+            others = [block for i, block in enumerate(blocks) if i != broken[0]]
+            xor_result = others[0]
+            for block in others[1:]:
+                xor_result = byte_xor(xor_result, block)
+            path = self.block_file(broken[0], filename)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(xor_result)
+            logger.warning(f"Scrub rebuilt block {broken[0]} of {filename}")
+            state = "repaired"
+        else:
+            state = "damaged"
+
+        health = "damaged" if state == "damaged" else "ok"
+        scrubbed_at = None if state == "damaged" else time.time()
+        if state == "damaged":
+            logger.error(f"Scrub found {filename} damaged beyond repair")
+        name = key_filename(filename)
+        if name is None:
+            self.index.set_content_health(
+                filename[len(CONTENT_PREFIX) :], health, scrubbed_at
+            )
+        else:
+            self.index.set_health(name, health, scrubbed_at)
+        return state, nbytes
+
+    def misplaced(self, after: str, limit: int) -> List[str]:
+        """Block keys after ``after`` not striped over NUM_DISKS disks"""
+        filename = key_filename(after)
+        cursor = (after, True) if filename is None else (filename, False)
+        rows = self.index.misplaced(
+            CONTENT_PREFIX, self.legacy_disks, settings.NUM_DISKS, cursor, limit
+        )
+        return [key if content else file_key(key) for key, content in rows]
+
+    async def reshape_file(self, key: str, num_disks: int) -> Tuple[str, int]:
+        """Restripe the blocks stored under ``key`` over ``num_disks`` disks
+
+        The new blocks are written under a temporary name first and swapped in
+        at once, so the file stays readable in its old layout until then.
+        Returns the state of the file, one of reshaped, ok when it already has
+        the layout, busy when it was written meanwhile or damaged, and the
+        number of bytes read.
+        """
+        if key in self.writing:
+            return "busy", 0
+        with self.reading(key):
+            return await self.__reshape_file(key, num_disks)
+
+    async def __reshape_file(self, key: str, num_disks: int) -> Tuple[str, int]:
+        generation = self.generation(key)
+        old = self.disks_of(key)
+        if old == num_disks:
+            return "ok", 0
+        meta = self.key_meta(key)
+        # blocks that cannot be verified are left to the scrubber to repair
+        read = await self.__read_blocks(key, old, hedge=False)
+        if meta is None or read is None or not read[1]:
+            return "damaged", 0
+        blocks = read[0]
+        nbytes = sum(len(block) for block in blocks)
+
+        # the stored bytes are moved as they are, compressed or not
+        stored = join_parts(blocks, meta["stored_size"])
+        parts = split_parts(stored, num_disks - 1)
+        parity_block = parts[0]
+        for part in parts[1:]:
+            parity_block = byte_xor(parity_block, part)
+        temps = [reshaping_file(self.block_file(i, key)) for i in range(num_disks)]
+        await asyncio.gather(
+            *(
+                write_part_file(temp, part)
+                for temp, part in zip(temps, parts + [parity_block])
+            )
+        )
+
+        if key in self.writing or self.generation(key) != generation:
+            for temp in temps:
+                temp.unlink(missing_ok=True)
+            return "busy", nbytes
+
+        # nothing below awaits, readers see either layout but never a mix
+        journal = {"key": key, "from": old, "to": num_disks, "stored": len(stored)}
+        self.index.set_state(RESHAPE_JOURNAL, json.dumps(journal))
+        self.__finish_reshape(journal)
+        return "reshaped", nbytes
+
+    def __finish_reshape(self, journal: dict) -> None:
+        key = journal["key"]
+        for i in range(journal["to"]):
+            path = self.block_file(i, key)
+            temp = reshaping_file(path)
+            if temp.exists():
+                os.replace(temp, path)
+        for i in range(journal["to"], journal["from"]):
+            self.block_file(i, key).unlink(missing_ok=True)
+        usage = Usage()
+        usage.add_blocks(journal["stored"], journal["from"], -1)
+        usage.add_blocks(journal["stored"], journal["to"])
+        with self.index.transaction():
+            filename = key_filename(key)
+            if filename is None:
+                self.index.set_content_num_disks(
+                    key[len(CONTENT_PREFIX) :], journal["to"]
+                )
+            else:
+                self.index.set_num_disks(filename, journal["to"], journal["stored"])
+            self.index.add_usage(usage.deltas)
+            self.index.set_state(RESHAPE_JOURNAL, None)
+        self.__touch(key)
+
+    def recover_reshape(self) -> None:
+        """Finish swapping in the blocks of a reshape interrupted by a crash"""
+        journal = self.index.get_state(RESHAPE_JOURNAL)
+        if journal is not None:
+            logger.warning(f"Finishing interrupted reshape: {journal}")
+            self.__finish_reshape(json.loads(journal))
 
     async def file_exist(self, filename: str) -> bool:
         # 1. all data blocks must exist
-        num_disks = settings.NUM_DISKS
+        key = block_key(filename, self.index.get(filename))
+        num_disks = self.disks_of(key)
 
         for i in range(num_disks):
-            if not os.path.exists(f"/var/raid/block-{i}/{filename}"):
-                print(f"/var/raid/block-{i}/{filename} Not exist")
+            if not self.block_file(i, key).exists():
+                print(f"{self.block_file(i, key)} Not exist")
                 await self.delete_file(filename)
                 return False
 
@@ -64,14 +798,19 @@ class Storage:
         so we need to delete the file
         """
 
-        num_disks = settings.NUM_DISKS
-        data_blocks = [f"/var/raid/block-{i}/{filename}" for i in range(num_disks - 1)]
-        parity_block = f"/var/raid/block-{num_disks - 1}/{filename}"
+        key = block_key(filename, self.index.get(filename))
+        num_disks = self.disks_of(key)
+        data_blocks = [self.block_file(i, key) for i in range(num_disks - 1)]
+        parity_block = self.block_file(num_disks - 1, key)
 
         if not await self.file_exist(filename):
             await self.delete_file(filename)
             return False
 
+        # a clean scrub already verified the parity
+        if self.recently_scrubbed(filename):
+            return True
+
         # 2. size of all data blocks must be equal
         first_block_size = os.path.getsize(data_blocks[0])
         if not all(os.path.getsize(block) == first_block_size for block in data_blocks):
@@ -96,6 +835,133 @@ class Storage:
             f.close()
         return True
 
+    async def __write_blocks(
+        self, file: UploadFile, content: bytes
+    ) -> Optional[Tuple[Path, bytes]]:
+        """Compress, stripe and write the content with its parity block
+
+        Returns the path and the content of the parity block, or None if
+        deduplication found the content already stored and nothing was written.
+        """
+        n = settings.NUM_DISKS
+        previous = self.index.get(file.filename)
+        checksum = hashlib.md5(content).hexdigest()
+        content_type = file.content_type or "application/octet-stream"
+        content_id = None
+        key = file_key(file.filename)
+        usage = Usage()
+        usage.add_file(len(content))
+        if previous is not None:
+            usage.add_file(previous["size"], -1)
+
+        if settings.DEDUP:
+            content_id = hashlib.sha256(content).hexdigest()
+            key = CONTENT_PREFIX + content_id
+            stored = self.index.acquire(content_id)
+            if stored is not None:
+                # another upload of the same content may still be writing it
+                while key in self.writing:
+                    await asyncio.sleep(0.01)
+                self.__touch(file.filename)
+                with self.index.transaction():
+                    self.index.put(
+                        file.filename,
+                        len(content),
+                        checksum,
+                        content_type,
+                        stored["codec"],
+                        stored["stored_size"],
+                        content_id,
+                    )
+                    unused = self.__release(previous, key, usage)
+                    self.index.add_usage(usage.deltas)
+                if unused is not None:
+                    self.__remove_blocks(unused)
+                return None
+
+        # compressing large content takes long, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        applied, stored = await loop.run_in_executor(
+            None, codec.encode, content, file.content_type
+        )
+        if content_id is not None:
+            self.index.add_content(content_id, applied, len(stored), n)
+        parts = split_parts(stored, n - 1)
+
+        parity_block = parts[0]
+        for part in parts[1:]:
+            parity_block = byte_xor(parity_block, part)
+        parity_file = self.block_file(n - 1, key)  # 奇偶校驗檔案
+
+        # 寫入所有部分檔案
+        self.writing.add(key)
+        try:
+            tasks = [
+                write_part_file(self.block_file(i, key), part)
+                for i, part in enumerate(parts)
+            ]
+            await asyncio.gather(*tasks, write_part_file(parity_file, parity_block))
+        except Exception:
+            if content_id is not None:
+                self.index.release(content_id)
+            raise
+        finally:
+            self.writing.discard(key)
+            self.__touch(key)
+            self.__touch(file.filename)
+        usage.add_blocks(len(stored), n)
+        # the counters change with the row, a crash in between would skew them
+        with self.index.transaction():
+            self.index.put(
+                file.filename,
+                len(content),
+                checksum,
+                content_type,
+                applied,
+                len(stored),
+                content_id,
+                None if content_id is not None else n,
+            )
+            unused = self.__release(previous, key, usage)
+            self.index.add_usage(usage.deltas)
+        if unused is not None:
+            self.__remove_blocks(unused)
+        return parity_file, parity_block
+
+    def __release(
+        self, previous: Optional[Dict], key: Optional[str], usage: Usage
+    ) -> Optional[str]:
+        """Release the blocks of the previous version of a file
+
+        ``key`` is where the new version is stored, the blocks found there
+        were already overwritten. Returns the key of the blocks no longer in
+        use, which the caller removes once the index is committed.
+        """
+        if previous is None:
+            return None
+        if previous["content_id"] is not None:
+            content = self.index.get_content(previous["content_id"])
+            if self.index.release(previous["content_id"]) > 0:
+                return None
+            if content is not None:
+                usage.add_blocks(*self.footprint(content), -1)
+        else:
+            stored_size, num_disks = self.footprint(previous)
+            usage.add_blocks(stored_size, num_disks, -1)
+            if block_key(previous["name"], previous) == key:
+                # the blocks past the disks written now were not overwritten
+                for i in range(self.disks_of(key), num_disks):
+                    self.block_file(i, key).unlink(missing_ok=True)
+                return None
+        return block_key(previous["name"], previous)
+
+    def __remove_blocks(self, key: str) -> None:
+        for i in range(len(self.block_path)):
+            file_path = self.block_file(i, key)
+            if os.path.exists(file_path):
+                self.__touch(key)
+                os.remove(file_path)
+
     async def create_file(self, file: UploadFile) -> schemas.File:
         content = await file.read()
         # TODO: create file with data block and parity block and return it's schema
@@ -113,92 +979,78 @@ class Storage:
             )
             return response
 
-        n = settings.NUM_DISKS
-
-        chunk_size = length // (n - 1)
-        print(chunk_size)
-
-        parts = []
-        now = 0
-
-        for i in range(length % (n - 1)):
-            part = content[now : now + chunk_size + 1]
-            parts.append(part)
-
-            now += chunk_size + 1
-
-        for i in range(length % (n - 1), n - 1):
-            part = content[now : now + chunk_size] + b"\x00"
-            parts.append(part)
-
-            now += chunk_size
-
-        parity_block = bytearray(parts[0])
-
-        # 寫入所有部分檔案
-        tasks = [
-            write_part_file(f"/var/raid/block-{i}/{file.filename}", part)
-            for i, part in enumerate(parts)
-        ]
-        await asyncio.gather(*tasks)
-
-        for part in parts[1:]:
-            parity_block = bytes(_a ^ _b for _a, _b in zip(parity_block, part))
-
-        parity_file = (
-            f"/var/raid/block-{n - 1}/{file.filename}"  # 奇偶校驗檔案的檔名，例如 parity.bin
-        )
-
-        with open(parity_file, "wb") as f:
-            f.write(parity_block)
-            f.close()
+        if self.over_watermark(length):
+            detail = {"detail": "Insufficient storage"}
+            response = Response(
+                content=json.dumps(detail),
+                status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+                headers={"Content-Type": "application/json"},
+            )
+            return response
 
-        await asyncio.sleep(length / 100000)
-        while True:
-            with open(parity_file, "rb") as f:
-                parity = bytearray(f.read())
-                f.close()
+        written = await self.__write_blocks(file, content)
+        if written is not None:
+            parity_file, parity_block = written
+            await asyncio.sleep(length / 100000)
+            while True:
+                with open(parity_file, "rb") as f:
+                    parity = bytearray(f.read())
+                    f.close()
                 if parity == parity_block:
-                    schema = {
-                        "name": file.filename,
-                        "size": length,
-                        "checksum": hashlib.md5(content).hexdigest(),
-                        "content": base64.b64encode(content).decode("utf-8"),
-                        "content_type": file.content_type,
-                    }
-
-                    response = Response(
-                        content=json.dumps(schema),
-                        status_code=status.HTTP_201_CREATED,
-                        headers={"Content-Type": "application/json"},
-                    )
+                    break
+
+        schema = {
+            "name": file.filename,
+            "size": length,
+            "checksum": hashlib.md5(content).hexdigest(),
+            "content": base64.b64encode(content).decode("utf-8"),
+            "content_type": file.content_type,
+        }
+
+        response = Response(
+            content=json.dumps(schema),
+            status_code=status.HTTP_201_CREATED,
+            headers={"Content-Type": "application/json"},
+        )
 
-                    return response
+        return response
 
-    async def retrieve_file(self, filename: str) -> bytes:
+    async def retrieve_file(self, filename: str) -> Optional[bytes]:
         # TODO: retrieve the binary data of file
-        file_data = b""
-
-        folder_names = os.listdir("/var/raid/")
-        folder_names.sort()  # 確保按照順序讀取檔案
-
-        if not await self.file_integrity(filename):
-            return b""
-
-        for i in range(len(folder_names) - 1):
-            file_path = f"/var/raid/block-{i}/{filename}"
-
-            if os.path.exists(file_path):
-                with open(file_path, "rb") as f:
-                    file_content = f.read()
-                    f.close()
-
-                # 移除尾部的填充 0x00
-                file_content = file_content.rstrip(b"\x00")
-
-                # 連接二進位數據
-                file_data += file_content
+        file_data = self.cache.get(filename, self.generation(filename))
+        if file_data is not None:
+            return file_data
+        meta = self.index.get(filename)
+        key = block_key(filename, meta)
+        with self.reading(filename, key):
+            generation = self.generation(filename)
+            layout = self.generation(key)
+            read = await self.__read_blocks(key, self.disks_of(key))
+            if (read is None or not read[1]) and self.generation(key) != layout:
+                # the blocks were rewritten or restriped while they were read,
+                # without parity the blocks read may mix both versions
+                return await self.retrieve_file(filename)
+            if read is None:
+                await self.delete_file(filename)
+                return None
+            blocks, verified = read
 
+            # 移除尾部的填充 0x00 並連接二進位數據
+            if meta is None:
+                file_data = join_parts(blocks, None)
+            else:
+                loop = asyncio.get_running_loop()
+                file_data = await loop.run_in_executor(
+                    None,
+                    codec.decode,
+                    meta["codec"],
+                    join_parts(blocks, meta["stored_size"]),
+                )
+
+            # a write meanwhile may have replaced what was read, and blocks
+            # not checked against parity could be corrupt
+            if verified and self.generation(filename) == generation:
+                self.cache.put(filename, generation, file_data)
         return file_data
 
     async def update_file(self, file: UploadFile) -> schemas.File:
@@ -219,47 +1071,18 @@ class Storage:
             )
             return response
 
-        n = settings.NUM_DISKS
-
-        chunk_size = length // (n - 1)
-        print(chunk_size)
-
-        parts = []
-        now = 0
+        if self.over_watermark(length):
+            detail = {"detail": "Insufficient storage"}
+            response = Response(
+                content=json.dumps(detail),
+                status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+                headers={"Content-Type": "application/json"},
+            )
+            return response
 
         File_exist = False
 
-        for i in range(length % (n - 1)):
-            part = content[now : now + chunk_size + 1]
-            parts.append(part)
-
-            now += chunk_size + 1
-
-        for i in range(length % (n - 1), n - 1):
-            part = content[now : now + chunk_size] + b"\x00"
-            parts.append(part)
-
-            now += chunk_size
-
-        parity_block = bytearray(parts[0])
-
-        # 寫入所有部分檔案
-        tasks = [
-            write_part_file(f"/var/raid/block-{i}/{file.filename}", part)
-            for i, part in enumerate(parts)
-        ]
-        await asyncio.gather(*tasks)
-
-        for part in parts[1:]:
-            parity_block = bytes(_a ^ _b for _a, _b in zip(parity_block, part))
-
-        parity_file = (
-            f"/var/raid/block-{n - 1}/{file.filename}"  # 奇偶校驗檔案的檔名，例如 parity.bin
-        )
-
-        with open(parity_file, "wb") as f:
-            f.write(parity_block)
-            f.close()
+        written = await self.__write_blocks(file, content)
 
         if File_exist:
             detail = {"detail": "File already exists"}
@@ -269,60 +1092,93 @@ class Storage:
             response.headers["Content-Type"] = "application/json"
             return response
 
-        await asyncio.sleep(length / 100000)
-        while True:
-            with open(parity_file, "rb") as f:
-                parity = bytearray(f.read())
-                f.close()
+        if written is not None:
+            parity_file, parity_block = written
+            await asyncio.sleep(length / 100000)
+            while True:
+                with open(parity_file, "rb") as f:
+                    parity = bytearray(f.read())
+                    f.close()
                 if parity == parity_block:
-                    schema = {
-                        "name": file.filename,
-                        "size": length,
-                        "checksum": hashlib.md5(content).hexdigest(),
-                        "content": base64.b64encode(content).decode("utf-8"),
-                        "content_type": file.content_type,
-                    }
-
-                    response = Response(
-                        content=json.dumps(schema),
-                        status_code=status.HTTP_200_OK,
-                        headers={"Content-Type": "application/json"},
-                    )
+                    break
+
+        schema = {
+            "name": file.filename,
+            "size": length,
+            "checksum": hashlib.md5(content).hexdigest(),
+            "content": base64.b64encode(content).decode("utf-8"),
+            "content_type": file.content_type,
+        }
+
+        response = Response(
+            content=json.dumps(schema),
+            status_code=status.HTTP_200_OK,
+            headers={"Content-Type": "application/json"},
+        )
 
-                    return response
+        return response
 
     async def delete_file(self, filename: str) -> None:
         # TODO: delete file's data block and parity block
-
-        for i in range(settings.NUM_DISKS):
-            file_path = f"/var/raid/block-{i}/{filename}"
-            if os.path.exists(file_path):
-                os.remove(file_path)
-
-        pass
+        meta = self.index.get(filename)
+        self.__touch(filename)
+        if meta is None:
+            self.index.remove(filename)
+            self.__remove_blocks(file_key(filename))
+            return
+        # the blocks of deduplicated content stay while other names share it
+        usage = Usage()
+        usage.add_file(meta["size"], -1)
+        with self.index.transaction():
+            self.index.remove(filename)
+            unused = self.__release(meta, None, usage)
+            self.index.add_usage(usage.deltas)
+        if unused is not None:
+            self.__remove_blocks(unused)
 
     async def fix_block(self, block_id: int) -> None:
         # TODO: fix the broke block by using rest of block
-
-        # list all filename in folder
-        folder_names = os.listdir(f"/var/raid/block-{settings.NUM_DISKS - 1}/")
-        folder_names.sort()  # 確保按照順序讀取檔案
-
-        for filename in folder_names:
-            with open(
-                f"/var/raid/block-{settings.NUM_DISKS - 1}/{filename}", "rb"
-            ) as f:
-                xor_result = bytearray(f.read())
-            for i in range(settings.NUM_DISKS - 1):
+        if not 0 <= block_id < len(self.block_path):
+            raise ValueError(f"There is no disk {block_id}")
+
+        # stream the filenames from a surviving disk
+        source = 1 if block_id == 0 else 0
+
+        # every object on the disk is rewritten, start a new cache epoch
+        self.epoch += 1
+        self.cache.clear()
+        self.index.forget_scrubs()
+        # the counters of the disk are replaced by what it holds after the rebuild
+        rebuilt = Usage()
+
+        for filename in self.__walk(source):
+            num_disks = self.disks_of(filename)
+            if block_id >= num_disks:
+                continue
+            blocks = [self.block_file(i, filename) for i in range(num_disks)]
+            if not all(blocks[i].exists() for i in range(num_disks) if i != block_id):
+                logger.error(f"Cannot fix {filename}, more than one block is lost")
+                continue
+
+            # the lost block is the XOR of all the others
+            xor_result = None
+            for i in range(num_disks):
                 if i == block_id:
                     continue
-                with open(f"/var/raid/block-{i}/{filename}", "rb") as f:
-                    xor_result = byte_xor(xor_result, bytearray(f.read()))
-
-            with open(f"/var/raid/block-{block_id}/{filename}", "wb") as f:
-                f.write(xor_result)
-                f.close()
-            pass
+                with open(blocks[i], "rb") as f:
+                    block = f.read()
+                xor_result = (
+                    block if xor_result is None else byte_xor(xor_result, block)
+                )
+
+            await write_part_file(blocks[block_id], xor_result)
+            meta = self.key_meta(filename)
+            if meta is not None:
+                rebuilt.add_block(*self.footprint(meta), block_id)
+
+        self.index.set_usage(
+            {disk_scope(block_id): rebuilt.deltas[disk_scope(block_id)]}
+        )
 
 
 storage: Storage = Storage(is_test="pytest" in sys.modules)
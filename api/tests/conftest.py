@@ -52,14 +52,25 @@ def large_file() -> Generator:
         yield fp
 
 
+@pytest.fixture(scope="session", autouse=True)
+def ready_storage():
+    # the app opens the storage on startup, which the test clients skip
+    storage.open()
+    storage.ready = True
+
+
 @pytest.fixture(autouse=True)
 def clean_env():
+    storage.index.clear()
     for path in storage.block_path:
         for child in path.glob("*"):
             if child.is_file():
                 child.unlink()
             else:
                 shutil.rmtree(child)
+    yield
+    # the index outlives the session and decides how many disks are read
+    storage.index.clear()
 
 
 @pytest.fixture()
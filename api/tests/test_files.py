@@ -0,0 +1,69 @@
+import io
+
+import pytest
+from fastapi import UploadFile
+from httpx import Response
+from storage import storage
+from tests import DEFAULT_FILE, RequestBody, ResponseBody, assert_request
+
+"""
+Test cases for list files endpoint
+@name files:list_files
+@router get /files/
+@status_code 200
+@response_model schemas.FileList
+"""
+
+
+@pytest.fixture()
+async def create_files() -> None:
+    for name in ("a/m3ow87.txt", "a/m3ow88.txt", "b/m3ow89.txt"):
+        upload_file = UploadFile(
+            filename=name,
+            file=io.BytesIO(DEFAULT_FILE.content),
+            content_type="text/plain",
+        )
+        await storage.create_file(upload_file)
+
+
+class TestListFiles:
+    def __assert_func(self, resp: Response, resp_body: ResponseBody):
+        assert resp.status_code == resp_body.status_code
+        body = resp.json()
+        assert [file["name"] for file in body["files"]] == resp_body.body["names"]
+        assert (body["next_cursor"] is not None) == resp_body.body["more"]
+        for file in body["files"]:
+            assert file["size"] == DEFAULT_FILE.size
+            assert file["checksum"] == DEFAULT_FILE.checksum
+            assert file["content_type"] == "text/plain"
+            assert file["health"] == "ok"
+        self.next_cursor = body["next_cursor"]
+
+    @pytest.mark.usefixtures("create_files")
+    async def test_list_files_paginated(self):
+        req = RequestBody(url="files:list_files", body=None, params={"limit": 2})
+        resp = ResponseBody(
+            status_code=200,
+            body={"names": ["a/m3ow87.txt", "a/m3ow88.txt"], "more": True},
+        )
+        await assert_request("get", req, resp, self.__assert_func)
+
+        req.params["cursor"] = self.next_cursor
+        resp = ResponseBody(
+            status_code=200, body={"names": ["b/m3ow89.txt"], "more": False}
+        )
+        await assert_request("get", req, resp, self.__assert_func)
+
+    @pytest.mark.usefixtures("create_files")
+    async def test_list_files_prefix(self):
+        req = RequestBody(url="files:list_files", body=None, params={"prefix": "a/"})
+        resp = ResponseBody(
+            status_code=200,
+            body={"names": ["a/m3ow87.txt", "a/m3ow88.txt"], "more": False},
+        )
+        await assert_request("get", req, resp, self.__assert_func)
+
+    async def test_list_files_invalid_cursor(self):
+        req = RequestBody(url="files:list_files", body=None, params={"cursor": "%%%"})
+        resp = ResponseBody(status_code=400, body={"detail": "Invalid cursor"})
+        await assert_request("get", req, resp)
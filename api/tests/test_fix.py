@@ -1,8 +1,12 @@
+import io
 import random
 import shutil
 
 import pytest
+from app import APP
 from config import settings
+from fastapi import UploadFile
+from httpx import AsyncClient
 from storage import storage
 from tests import DEFAULT_FILE
 
@@ -27,3 +31,20 @@ class TestFixFile:
         await storage.fix_block(block_id)
         content = await storage.retrieve_file(DEFAULT_FILE.name)
         assert content.decode() == DEFAULT_FILE.content
+
+    @pytest.mark.parametrize("block_id", [-1, 99])
+    async def test_fix_unknown_disk(self, block_id):
+        await storage.create_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Do U Want To Meow?"))
+        )
+        parity = storage.block_file(settings.NUM_DISKS - 1, "m3ow87.txt")
+        before = parity.read_bytes()
+
+        async with AsyncClient(app=APP, base_url="https://localhost") as ac:
+            resp = await ac.post(APP.url_path_for("fix:fix_block", block_id=block_id))
+        assert resp.status_code == 404
+        assert resp.json() == {"detail": "Disk not found"}
+        with pytest.raises(ValueError):
+            await storage.fix_block(block_id)
+        assert parity.read_bytes() == before
+        assert f"disk-{block_id}" not in storage.index.usage()
@@ -1,3 +1,10 @@
+import threading
+import time
+
+import pytest
+from config import settings
+from httpx import Response
+from storage import Storage, storage
 from tests import RequestBody, ResponseBody, assert_request
 
 
@@ -5,3 +12,74 @@ async def test_get_health_success() -> None:
     req = RequestBody(url="health:get_health", body=None)
     resp = ResponseBody(status_code=200, body={"detail": "Service healthy test"})
     await assert_request("get", req, resp)
+
+
+async def test_get_disks_health_success() -> None:
+    def assert_func(resp: Response, resp_body: ResponseBody):
+        assert resp.status_code == resp_body.status_code
+        assert [disk["disk"] for disk in resp.json()] == resp_body.body
+
+    req = RequestBody(url="health:get_disks_health", body=None)
+    resp = ResponseBody(status_code=200, body=list(range(settings.NUM_DISKS)))
+    await assert_request("get", req, resp, assert_func)
+
+
+async def test_get_disks_capacity_success() -> None:
+    def assert_func(resp: Response, resp_body: ResponseBody):
+        assert resp.status_code == resp_body.status_code
+        for disk in resp.json():
+            assert disk["exists"] and disk["writable"]
+            assert 0 < disk["free_bytes"] <= disk["total_bytes"]
+
+    req = RequestBody(url="health:get_disks_health", body=None)
+    resp = ResponseBody(status_code=200, body=None)
+    await assert_request("get", req, resp, assert_func)
+
+
+async def test_get_ready_success() -> None:
+    await storage.startup()
+    req = RequestBody(url="health:get_ready", body=None)
+    resp = ResponseBody(status_code=200, body={"detail": "Service ready"})
+    await assert_request("get", req, resp)
+
+
+async def test_get_ready_starting(monkeypatch) -> None:
+    monkeypatch.setattr(storage, "ready", False)
+    req = RequestBody(url="health:get_ready", body=None)
+    resp = ResponseBody(status_code=503, body={"detail": "Service starting"})
+    await assert_request("get", req, resp)
+
+
+def test_storage_opens_lazily() -> None:
+    lazy = Storage(is_test=True)
+    assert "index" not in vars(lazy)
+    assert lazy.block_path == storage.block_path
+    assert "index" in vars(lazy)
+
+
+async def test_storage_routes_wait_for_storage(monkeypatch) -> None:
+    monkeypatch.setattr(storage, "ready", False)
+    req = RequestBody(url="files:list_files", body=None)
+    resp = ResponseBody(status_code=503, body={"detail": "Service starting"})
+    await assert_request("get", req, resp)
+
+
+async def test_event_loop_does_not_wait_for_open(monkeypatch) -> None:
+    lazy = Storage(is_test=True)
+    open_storage = lazy._Storage__open
+
+    def slow_open() -> None:
+        time.sleep(0.5)
+        open_storage()
+
+    monkeypatch.setattr(lazy, "_Storage__open", slow_open)
+    opening = threading.Thread(target=lazy.open)
+    opening.start()
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError):
+        lazy.index
+    assert time.monotonic() - start < 0.1
+    opening.join()
+    assert lazy.index is not None
@@ -0,0 +1,133 @@
+import io
+
+from cache import ReadCache
+from config import settings
+from fastapi import UploadFile
+from reshape import reshaper
+from scrubber import Scrubber, scrubber
+from storage import storage
+from tests import RequestBody, ResponseBody, assert_request
+
+"""
+Test case for cache stats endpoint
+@name stats:get_cache_stats
+@router get /stats/cache
+@status_code 200
+@response_model schemas.CacheStats
+"""
+
+
+class TestCacheStats:
+    async def test_get_cache_stats_success(self):
+        req = RequestBody(url="stats:get_cache_stats", body=None)
+        resp = ResponseBody(status_code=200, body=storage.cache.stats())
+        await assert_request("get", req, resp)
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = ReadCache(max_bytes=10)
+        cache.put("a", 1, b"aaaa")
+        cache.put("b", 1, b"bbbb")
+        assert cache.get("a", 1) == b"aaaa"
+
+        cache.put("c", 1, b"cccc")
+        assert cache.get("b", 1) is None
+        assert cache.get("a", 1) == b"aaaa"
+        assert cache.stats()["evictions"] == 1
+        assert cache.size == 8
+
+    def test_cache_misses_on_stale_generation(self):
+        cache = ReadCache(max_bytes=10)
+        cache.put("a", 1, b"aaaa")
+        assert ("a", 2) not in cache
+        assert cache.get("a", 2) is None
+        assert cache.stats()["hits"] == 0
+        assert cache.stats()["misses"] == 1
+
+
+"""
+Test case for scrub stats endpoint
+@name stats:get_scrub_stats
+@router get /stats/scrub
+@status_code 200
+@response_model schemas.ScrubStats
+"""
+
+
+class TestScrubStats:
+    async def test_get_scrub_stats_success(self):
+        req = RequestBody(url="stats:get_scrub_stats", body=None)
+        resp = ResponseBody(status_code=200, body=scrubber.stats())
+        await assert_request("get", req, resp)
+
+    async def test_truncated_block_is_repaired(self, monkeypatch):
+        monkeypatch.setattr(settings, "SCRUB_IDLE", 0)
+        await storage.create_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Do U Want To Meow?"))
+        )
+        block = storage.block_file(1, "m3ow87.txt")
+        content = block.read_bytes()
+        block.write_bytes(content[:2])
+
+        scrubbing = Scrubber(storage)
+        await scrubbing.scrub_all()
+        assert scrubbing.stats()["states"] == {"repaired": 1}
+        assert block.read_bytes() == content
+        assert storage.recently_scrubbed("m3ow87.txt")
+        assert await storage.file_integrity("m3ow87.txt")
+
+    async def test_same_size_corruption_is_damaged(self):
+        await storage.create_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Do U Want To Meow?"))
+        )
+        block = storage.block_file(0, "m3ow87.txt")
+        block.write_bytes(bytes(len(block.read_bytes())))
+
+        state, _ = await storage.scrub_file("m3ow87.txt")
+        assert state == "damaged"
+        assert storage.index.get("m3ow87.txt")["health"] == "damaged"
+        assert not storage.recently_scrubbed("m3ow87.txt")
+
+    async def test_integrity_skips_parity_of_fresh_scrub(self):
+        await storage.create_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Do U Want To Meow?"))
+        )
+        assert (await storage.scrub_file("m3ow87.txt"))[0] == "ok"
+        parity = storage.block_file(settings.NUM_DISKS - 1, "m3ow87.txt")
+        parity.write_bytes(bytes(len(parity.read_bytes())))
+
+        # the corruption goes unnoticed until the scrub is no longer fresh
+        assert await storage.file_integrity("m3ow87.txt")
+        storage.index.forget_scrubs()
+        assert not await storage.file_integrity("m3ow87.txt")
+
+
+"""
+Test case for reshape stats endpoint
+@name stats:get_reshape_stats
+@router get /stats/reshape
+@status_code 200
+@response_model schemas.ReshapeStats
+"""
+
+
+class TestReshapeStats:
+    async def test_get_reshape_stats_success(self):
+        req = RequestBody(url="stats:get_reshape_stats", body=None)
+        resp = ResponseBody(status_code=200, body=reshaper.stats())
+        await assert_request("get", req, resp)
+
+
+"""
+Test case for usage stats endpoint
+@name stats:get_usage_stats
+@router get /stats/usage
+@status_code 200
+@response_model schemas.UsageStats
+"""
+
+
+class TestUsageStats:
+    async def test_get_usage_stats_success(self):
+        req = RequestBody(url="stats:get_usage_stats", body=None)
+        resp = ResponseBody(status_code=200, body=storage.usage())
+        await assert_request("get", req, resp)
@@ -0,0 +1,491 @@
+import asyncio
+import io
+import os
+
+import pytest
+from app import migrate_and_index
+from config import settings
+from fastapi import UploadFile
+from latency import DiskLatency
+from reshape import reshaper
+from storage import Storage, file_key, storage
+
+
+async def create(filename: str, content: bytes) -> None:
+    await storage.create_file(UploadFile(filename=filename, file=io.BytesIO(content)))
+
+
+class TestLayout:
+    async def test_blocks_are_sharded(self):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        for i, path in enumerate(storage.block_path):
+            block = storage.block_file(i, "m3ow87.txt")
+            assert block.exists()
+            assert len(block.relative_to(path).parts) == 3
+        assert list(storage.iter_files()) == ["m3ow87.txt"]
+
+    async def test_names_with_slashes_are_walked(self):
+        await create("a/m3ow87.txt", b"Do U Want To Meow With Me?")
+        await create("100%.txt", b"Let's M3ow M3ow M3ow All Day!")
+        for i, path in enumerate(storage.block_path):
+            block = storage.block_file(i, "a/m3ow87.txt")
+            assert len(block.relative_to(path).parts) == 3
+        assert sorted(storage.iter_files()) == ["100%.txt", "a/m3ow87.txt"]
+
+        storage.block_file(0, "a/m3ow87.txt").unlink()
+        await storage.fix_block(0)
+        assert storage.block_file(0, "a/m3ow87.txt").exists()
+
+    async def test_unescaped_blocks_are_moved(self):
+        await create("a/m3ow87.txt", b"Do U Want To Meow With Me?")
+        for i in range(len(storage.block_path)):
+            block = storage.block_file(i, "a/m3ow87.txt")
+            (block.parent / "a").mkdir()
+            block.rename(block.parent / "a/m3ow87.txt")
+
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("a/m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert list(storage.iter_files()) == ["a/m3ow87.txt"]
+
+    async def test_blocks_of_names_starting_with_at_are_moved(self):
+        await create("@m3ow87.txt", b"Do U Want To Meow With Me?")
+        for i in range(len(storage.block_path)):
+            block = storage.block_file(i, file_key("@m3ow87.txt"))
+            block.rename(block.parent / "@m3ow87.txt")
+
+        assert list(storage.iter_files()) == [file_key("@m3ow87.txt")]
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("@m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+
+    async def test_flat_layout_is_migrated(self):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        await create("87m3ow.txt", b"Let's M3ow M3ow M3ow All Day!")
+        for i, path in enumerate(storage.block_path):
+            for filename in ("m3ow87.txt", "87m3ow.txt"):
+                storage.block_file(i, filename).rename(path / filename)
+
+        migrating = Storage(is_test=True)
+        assert migrating.flat == set(range(len(storage.block_path)))
+        assert (
+            await migrating.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+
+        await migrating.migrate_layout()
+        assert migrating.flat == set()
+        assert sorted(migrating.iter_files()) == ["87m3ow.txt", "m3ow87.txt"]
+        for path in storage.block_path:
+            assert all(child.is_dir() for child in path.iterdir())
+
+    async def test_flat_layout_is_indexed_after_migration(self, monkeypatch):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        await create("87m3ow.txt", b"Let's M3ow M3ow M3ow All Day!")
+        for i, path in enumerate(storage.block_path):
+            for filename in ("m3ow87.txt", "87m3ow.txt"):
+                storage.block_file(i, filename).rename(path / filename)
+        storage.index.clear()
+        storage.index.set_state("indexed", None)
+        monkeypatch.setattr(storage, "flat", set(range(len(storage.block_path))))
+
+        await migrate_and_index()
+        assert storage.flat == set()
+        assert storage.index.get("m3ow87.txt")["size"] == 26
+        assert storage.index.get("87m3ow.txt")["size"] == 29
+
+
+class TestDiskPaths:
+    async def test_blocks_are_stored_on_configured_paths(self, monkeypatch, tmp_path):
+        paths = [str(tmp_path / f"disk{i}") for i in range(settings.NUM_DISKS)]
+        monkeypatch.setattr(settings, "DISK_PATHS", paths)
+        monkeypatch.setattr(settings, "INDEX_PATH", str(tmp_path / "index.db"))
+
+        mounted = Storage(is_test=False)
+        assert [str(path) for path in mounted.block_path] == paths
+        await mounted.create_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Do U Want To Meow?"))
+        )
+        for i, path in enumerate(paths):
+            assert mounted.block_file(i, "m3ow87.txt").is_relative_to(path)
+        assert await mounted.retrieve_file("m3ow87.txt") == b"Do U Want To Meow?"
+        assert [disk["path"] for disk in mounted.disk_health()] == paths
+
+    def test_missing_disk_path_is_rejected(self, monkeypatch):
+        monkeypatch.setattr(settings, "DISK_PATHS", ["/var/raid/block-0-test"])
+        with pytest.raises(ValueError):
+            Storage(is_test=False).open()
+
+
+class TestUsage:
+    async def test_counters_follow_writes(self, monkeypatch):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        usage = storage.usage()
+        assert usage["objects"] == 1
+        assert usage["logical_bytes"] == 26
+        assert usage["physical_bytes"] == settings.NUM_DISKS * (
+            26 // (settings.NUM_DISKS - 1) + 1
+        )
+        assert usage["parity_bytes"] == usage["disks"][-1]["physical_bytes"]
+
+        monkeypatch.setattr(settings, "DEDUP", True)
+        await create("87m3ow.txt", b"Let's M3ow M3ow M3ow All Day!")
+        await create("m3ow.txt", b"Let's M3ow M3ow M3ow All Day!")
+        await storage.update_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Meow"))
+        )
+        await storage.delete_file("m3ow.txt")
+        await storage.fix_block(1)
+
+        # the counters match what the index holds
+        counted = storage.usage()
+        storage.recount_usage()
+        assert storage.usage() == counted
+        assert counted["objects"] == 2
+        assert counted["logical_bytes"] == 4 + 29
+
+    async def test_rows_and_counters_change_together(self, monkeypatch):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        counted = storage.usage()
+
+        def crash(deltas):
+            raise RuntimeError("crash")
+
+        monkeypatch.setattr(storage.index, "add_usage", crash)
+        with pytest.raises(RuntimeError):
+            await storage.delete_file("m3ow87.txt")
+        with pytest.raises(RuntimeError):
+            await create("87m3ow.txt", b"Let's M3ow M3ow M3ow All Day!")
+        assert storage.index.get("m3ow87.txt") is not None
+        assert storage.index.get("87m3ow.txt") is None
+        assert storage.usage() == counted
+        monkeypatch.undo()
+        assert await storage.file_integrity("m3ow87.txt")
+
+    async def test_writes_past_watermark_are_rejected(self, monkeypatch):
+        monkeypatch.setattr(settings, "CAPACITY_WATERMARK", 1e-9)
+        resp = await storage.create_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Do U Want To Meow?"))
+        )
+        assert resp.status_code == 507
+        assert list(storage.iter_files()) == []
+
+
+class TestCompression:
+    async def test_compressed_round_trip(self, monkeypatch):
+        monkeypatch.setattr(settings, "COMPRESSION", "zlib")
+        content = b"Do U Want To Meow With Me?\n" * 1000
+        await create("m3ow87.txt", content)
+
+        meta = storage.index.get("m3ow87.txt")
+        assert meta["codec"] == "zlib"
+        assert meta["size"] == len(content)
+        assert meta["stored_size"] < len(content) // 10
+        assert storage.block_file(0, "m3ow87.txt").stat().st_size < len(content) // 10
+        storage.cache.clear()
+        assert await storage.retrieve_file("m3ow87.txt") == content
+
+    async def test_random_content_is_stored_as_is(self, monkeypatch):
+        monkeypatch.setattr(settings, "COMPRESSION", "zlib")
+        content = os.urandom(64 * 1024)
+        await create("m3ow87.bin", content)
+
+        assert storage.index.get("m3ow87.bin")["codec"] == "none"
+        storage.cache.clear()
+        assert await storage.retrieve_file("m3ow87.bin") == content
+
+    def test_unknown_codec_is_rejected(self, monkeypatch):
+        monkeypatch.setattr(settings, "COMPRESSION", "zlibb")
+        with pytest.raises(ValueError):
+            Storage(is_test=True).open()
+
+    async def test_trailing_zero_bytes_are_kept(self):
+        content = b"Do U Want To Meow With Me?\x00\x00\x00"
+        await create("m3ow87.txt", content)
+        storage.cache.clear()
+        assert await storage.retrieve_file("m3ow87.txt") == content
+
+
+class TestDedup:
+    async def test_identical_uploads_share_blocks(self, monkeypatch):
+        monkeypatch.setattr(settings, "DEDUP", True)
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        await create("87m3ow.txt", b"Do U Want To Meow With Me?")
+
+        keys = list(storage.iter_files())
+        assert len(keys) == 1 and keys[0].startswith("@")
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("87m3ow.txt") == b"Do U Want To Meow With Me?"
+        )
+
+        await storage.delete_file("m3ow87.txt")
+        assert list(storage.iter_files()) == keys
+        assert await storage.file_exist("87m3ow.txt")
+
+        await storage.delete_file("87m3ow.txt")
+        assert list(storage.iter_files()) == []
+
+    async def test_update_releases_previous_content(self, monkeypatch):
+        monkeypatch.setattr(settings, "DEDUP", True)
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        await create("87m3ow.txt", b"Do U Want To Meow With Me?")
+        await storage.update_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Let's M3ow All Day!"))
+        )
+        assert len(list(storage.iter_files())) == 2
+
+        await storage.update_file(
+            UploadFile(filename="87m3ow.txt", file=io.BytesIO(b"Let's M3ow All Day!"))
+        )
+        assert len(list(storage.iter_files())) == 1
+        storage.cache.clear()
+        assert await storage.retrieve_file("87m3ow.txt") == b"Let's M3ow All Day!"
+
+    async def test_names_like_content_keep_their_blocks(self, monkeypatch):
+        monkeypatch.setattr(settings, "DEDUP", True)
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        content_key = "@" + storage.index.get("m3ow87.txt")["content_id"]
+        monkeypatch.setattr(settings, "DEDUP", False)
+        await create(content_key, b"Let's M3ow M3ow M3ow All Day!")
+
+        assert sorted(storage.iter_files()) == sorted(
+            [content_key, file_key(content_key)]
+        )
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert await storage.retrieve_file(content_key) == (
+            b"Let's M3ow M3ow M3ow All Day!"
+        )
+
+        await storage.delete_file(content_key)
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+
+
+class TestReshape:
+    async def test_files_are_restriped_onto_fewer_disks(self, monkeypatch):
+        monkeypatch.setattr(settings, "RESHAPE_IDLE", 0)
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?\x00")
+        num_disks = settings.NUM_DISKS
+        monkeypatch.setattr(settings, "NUM_DISKS", num_disks - 1)
+
+        # the old layout stays readable until the file is restriped
+        assert await storage.file_exist("m3ow87.txt")
+        assert storage.misplaced("", 10) == ["m3ow87.txt"]
+
+        await reshaper.reshape_all()
+        assert storage.misplaced("", 10) == []
+        assert storage.disks_of("m3ow87.txt") == num_disks - 1
+        assert not storage.block_file(num_disks - 1, "m3ow87.txt").exists()
+        counted = storage.usage()
+        storage.recount_usage()
+        assert storage.usage() == counted
+        assert counted["disks"][num_disks - 1]["blocks"] == 0
+        assert await storage.file_integrity("m3ow87.txt")
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("m3ow87.txt")
+            == b"Do U Want To Meow With Me?\x00"
+        )
+
+    async def test_files_are_restriped_onto_more_disks(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(settings, "RESHAPE_IDLE", 0)
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        monkeypatch.setattr(storage, "block_path", storage.block_path + [tmp_path])
+        monkeypatch.setattr(settings, "NUM_DISKS", len(storage.block_path))
+
+        state, _ = await storage.reshape_file("m3ow87.txt", settings.NUM_DISKS)
+        assert state == "reshaped"
+        assert storage.block_file(settings.NUM_DISKS - 1, "m3ow87.txt").exists()
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+
+    async def test_names_with_slashes_are_restriped(self, monkeypatch):
+        monkeypatch.setattr(settings, "RESHAPE_IDLE", 0)
+        await create("a/m3ow87.txt", b"Do U Want To Meow With Me?")
+        await create("b/m3ow87.txt", b"Let's M3ow M3ow M3ow All Day!")
+        monkeypatch.setattr(settings, "NUM_DISKS", settings.NUM_DISKS - 1)
+
+        await reshaper.reshape_all()
+        assert storage.misplaced("", 10) == []
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("b/m3ow87.txt")
+            == b"Let's M3ow M3ow M3ow All Day!"
+        )
+
+    async def test_names_starting_with_at_are_restriped(self, monkeypatch):
+        monkeypatch.setattr(settings, "RESHAPE_IDLE", 0)
+        await create("@m3ow87.txt", b"Do U Want To Meow With Me?")
+        await create("%40m3ow87.txt", b"Let's M3ow M3ow M3ow All Day!")
+        num_disks = settings.NUM_DISKS
+        monkeypatch.setattr(settings, "NUM_DISKS", num_disks - 1)
+
+        assert await storage.file_exist("@m3ow87.txt")
+        assert storage.misplaced("", 10) == [
+            file_key("%40m3ow87.txt"),
+            file_key("@m3ow87.txt"),
+        ]
+        await reshaper.reshape_all()
+        assert storage.misplaced("", 10) == []
+        assert storage.disks_of(file_key("@m3ow87.txt")) == num_disks - 1
+        assert storage.index.get("@m3ow87.txt")["num_disks"] == num_disks - 1
+
+        storage.cache.clear()
+        assert (
+            await storage.retrieve_file("@m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert (
+            await storage.retrieve_file("%40m3ow87.txt")
+            == b"Let's M3ow M3ow M3ow All Day!"
+        )
+        assert (await storage.scrub_file(file_key("@m3ow87.txt")))[0] == "ok"
+        assert storage.index.get("@m3ow87.txt")["scrubbed_at"] is not None
+        storage.index.clear()
+        await storage.rebuild_index()
+        assert storage.index.get("@m3ow87.txt")["size"] == 26
+
+    async def test_update_onto_fewer_disks_drops_old_blocks(self, monkeypatch):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        num_disks = settings.NUM_DISKS
+        monkeypatch.setattr(settings, "NUM_DISKS", num_disks - 1)
+
+        await storage.update_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Let's M3ow All Day!"))
+        )
+        assert not storage.block_file(num_disks - 1, "m3ow87.txt").exists()
+        assert storage.usage()["disks"][num_disks - 1]["blocks"] == 0
+
+
+class TestReadCache:
+    async def test_writes_invalidate_cached_content(self):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert storage.is_cached("m3ow87.txt")
+
+        await storage.update_file(
+            UploadFile(filename="m3ow87.txt", file=io.BytesIO(b"Let's M3ow All Day!"))
+        )
+        assert not storage.is_cached("m3ow87.txt")
+        assert await storage.retrieve_file("m3ow87.txt") == b"Let's M3ow All Day!"
+
+        await storage.fix_block(0)
+        assert not storage.is_cached("m3ow87.txt")
+        assert await storage.retrieve_file("m3ow87.txt") == b"Let's M3ow All Day!"
+
+        await storage.delete_file("m3ow87.txt")
+        assert not storage.is_cached("m3ow87.txt")
+        assert await storage.retrieve_file("m3ow87.txt") is None
+
+    async def test_generations_are_dropped_after_reads(self):
+        for i in range(10):
+            await create(f"m3ow{i}.txt", b"Do U Want To Meow With Me?")
+            await storage.retrieve_file(f"m3ow{i}.txt")
+            await storage.delete_file(f"m3ow{i}.txt")
+        assert storage.generations == {}
+        assert not storage.readers
+
+
+@pytest.fixture()
+async def slow_disk(monkeypatch):
+    """Delay the block reads of the disks set in the returned dict by seconds"""
+    monkeypatch.setattr(storage, "latency", DiskLatency(settings.LATENCY_ALPHA))
+    read_block = storage._Storage__read_block
+    delays = {}
+
+    async def delayed(disk: int, filename: str) -> bytes:
+        await asyncio.sleep(delays.get(disk, 0))
+        return await read_block(disk, filename)
+
+    monkeypatch.setattr(storage, "_Storage__read_block", delayed)
+    yield delays
+    # let the straggler finish before the event loop closes
+    await asyncio.sleep(max(delays.values(), default=0))
+
+
+class TestHedgedReads:
+    async def test_slow_data_disk_is_rebuilt_from_parity(self, slow_disk):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        storage.cache.clear()
+        slow_disk[1] = 0.3
+
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert storage.latency.hedged == {1: 1}
+        # a rebuilt block cannot be checked, so it is not cached
+        assert not storage.is_cached("m3ow87.txt")
+
+    async def test_slow_parity_disk_is_skipped(self, slow_disk):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        storage.cache.clear()
+        slow_disk[settings.NUM_DISKS - 1] = 0.3
+
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert storage.latency.hedged == {settings.NUM_DISKS - 1: 1}
+        assert not storage.is_cached("m3ow87.txt")
+
+    @pytest.mark.parametrize("disk", [0, -1])
+    async def test_missing_block_is_tolerated(self, disk):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        storage.cache.clear()
+        storage.block_file(disk % settings.NUM_DISKS, "m3ow87.txt").unlink()
+
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert not storage.is_cached("m3ow87.txt")
+        # the file is restriped once the scrubber repaired it
+        state, _ = await storage.reshape_file("m3ow87.txt", settings.NUM_DISKS - 1)
+        assert state == "damaged"
+
+    async def test_uniformly_slow_disks_are_not_hedged(self, slow_disk):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        storage.cache.clear()
+        # large blocks take long to read on every disk
+        slow_disk.update({i: 0.05 for i in range(settings.NUM_DISKS)})
+        slow_disk[0] = 0.06
+
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert storage.latency.hedged == {}
+        assert storage.is_cached("m3ow87.txt")
+
+    async def test_unverified_read_during_update_is_retried(self, slow_disk):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        storage.cache.clear()
+        slow_disk[1] = 0.3
+        slow_disk[0] = 0.05
+
+        reading = asyncio.ensure_future(storage.retrieve_file("m3ow87.txt"))
+        await asyncio.sleep(0.01)
+        # blocks of the same size, only parity tells the versions apart
+        await storage.update_file(
+            UploadFile(
+                filename="m3ow87.txt", file=io.BytesIO(b"Do U Want To Purr With Me?")
+            )
+        )
+        assert await reading == b"Do U Want To Purr With Me?"
+
+    async def test_verified_read_is_cached(self, slow_disk):
+        await create("m3ow87.txt", b"Do U Want To Meow With Me?")
+        storage.cache.clear()
+
+        assert (
+            await storage.retrieve_file("m3ow87.txt") == b"Do U Want To Meow With Me?"
+        )
+        assert storage.latency.hedged == {}
+        assert storage.is_cached("m3ow87.txt")
@@ -0,0 +1,48 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class TokenBucket:
+    """Limit a background job to ``rate`` bytes per second"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def consume(self, nbytes: int) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= nbytes
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class Activity:
+    """Track client requests so that background jobs can yield to them"""
+
+    def __init__(self):
+        self.active = 0
+        self.last = 0.0
+
+    @contextmanager
+    def request(self) -> Iterator[None]:
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.last = time.monotonic()
+
+    async def wait_idle(self, idle: float) -> None:
+        """Wait until no request has been served for ``idle`` seconds"""
+        while self.active or time.monotonic() - self.last < idle:
+            await asyncio.sleep(idle)
+
+
+foreground: Activity = Activity()
@@ -0,0 +1,82 @@
+from collections import Counter, defaultdict
+from typing import Any, Dict, List
+
+# counted for every disk, the others only for the whole store
+DISK_FIELDS = ("blocks", "physical_bytes", "padding_bytes", "parity_bytes")
+# scope of the counters of the whole store, the others count a single disk
+TOTAL = "total"
+
+
+def disk_scope(disk: int) -> str:
+    return f"disk-{disk}"
+
+
+def block_usage(stored_size: int, num_disks: int) -> List[Dict[str, int]]:
+    """Bytes every block of a file of ``stored_size`` bytes takes on its disk
+
+    Every block holds ``stored_size // (num_disks - 1) + 1`` bytes, the data
+    blocks after the first ``stored_size % (num_disks - 1)`` end with a padding
+    byte and the last block is the parity.
+    """
+    data_disks = num_disks - 1
+    size = stored_size // data_disks + 1
+    extra = stored_size % data_disks
+    blocks = [
+        {
+            "blocks": 1,
+            "physical_bytes": size,
+            "padding_bytes": 0 if i < extra else 1,
+            "parity_bytes": 0,
+        }
+        for i in range(data_disks)
+    ]
+    blocks.append(
+        {"blocks": 1, "physical_bytes": size, "padding_bytes": 0, "parity_bytes": size}
+    )
+    return blocks
+
+
+class Usage:
+    """Changes an operation makes to the usage counters"""
+
+    def __init__(self):
+        self.deltas: Dict[str, Counter] = defaultdict(Counter)
+
+    def add_file(self, size: int, sign: int = 1) -> None:
+        self.deltas[TOTAL]["objects"] += sign
+        self.deltas[TOTAL]["logical_bytes"] += sign * size
+
+    def add_block(
+        self, stored_size: int, num_disks: int, disk: int, sign: int = 1
+    ) -> None:
+        for field, value in block_usage(stored_size, num_disks)[disk].items():
+            self.deltas[disk_scope(disk)][field] += sign * value
+
+    def add_blocks(self, stored_size: int, num_disks: int, sign: int = 1) -> None:
+        for disk in range(num_disks):
+            self.add_block(stored_size, num_disks, disk, sign)
+
+
+def summarize(counters: Dict[str, Dict[str, int]], num_disks: int) -> Dict[str, Any]:
+    """Totals of the store and the counters of every disk"""
+    disks = [
+        {
+            "disk": disk,
+            **{
+                field: counters.get(disk_scope(disk), {}).get(field, 0)
+                for field in DISK_FIELDS
+            },
+        }
+        for disk in range(num_disks)
+    ]
+    total = counters.get(TOTAL, {})
+    return {
+        "objects": total.get("objects", 0),
+        "logical_bytes": total.get("logical_bytes", 0),
+        **{
+            field: sum(disk[field] for disk in disks)
+            for field in DISK_FIELDS
+            if field != "blocks"
+        },
+        "disks": disks,
+    }